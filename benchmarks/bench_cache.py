@@ -0,0 +1,66 @@
+"""
+Load time of CachedCSVDataHandler on synthetic data (see synthetic.py).
+
+The first load parses the CSV files and writes the CSVBarCache entries; the
+warm loads read the cached (rows x fields) arrays and copy them into the store.
+Run from the repository root:
+
+    python benchmarks/bench_cache.py
+    python benchmarks/bench_cache.py --symbols 500 --bars 5000
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+sys.path.append(os.getcwd())
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from pytrade.datahandler import CachedCSVDataHandler
+from pytrade.eventbus import DequeEventBus
+from synthetic import make_calendar, write_universe
+
+
+def best_of(func, repeat):
+    """
+    Returns the smallest wall time of repeat calls of func.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--symbols', type=int, default=1000)
+    parser.add_argument('--bars', type=int, default=2520)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    data_dir = tempfile.mkdtemp(prefix='pytrade_bench_cache_')
+    try:
+        symbols = write_universe(data_dir, args.symbols, args.bars)
+        calendar = make_calendar(args.bars)
+        start_date, end_date = calendar[args.bars // 4], calendar[3 * args.bars // 4]
+
+        def load(start=None, end=None):
+            return CachedCSVDataHandler(DequeEventBus(), data_dir, symbols, start, end)
+
+        results = [
+            ('cold load (parse + build cache)', best_of(load, 1)),
+            ('warm load, all bars', best_of(load, args.repeat)),
+            ('warm load, middle half', best_of(lambda: load(start_date, end_date), args.repeat)),
+        ]
+        print(f"{args.symbols} symbols x {args.bars} bars")
+        for name, seconds in results:
+            print(f"{name:34s} {seconds:8.3f} s")
+    finally:
+        shutil.rmtree(data_dir)
+
+
+if __name__ == '__main__':
+    main()
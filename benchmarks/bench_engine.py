@@ -0,0 +1,229 @@
+"""
+Benchmarks of the engine's core paths on synthetic data (see synthetic.py):
+
+- data load time of HistoricCSVDataHandler, full files and a date range
+- bars/sec and events/sec of a full Backtest run
+- create_drawdowns() time
+- peak traced memory of a load + backtest
+- ParameterSweep time by number of workers
+
+Results are written as JSON, and can be compared with an earlier run to catch
+regressions as numbers. Run from the repository root:
+
+    python benchmarks/bench_engine.py --symbols 10 --bars 5000
+    python benchmarks/bench_engine.py --freq minute --bars 100000 --compare benchmarks/results/old.json
+"""
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+sys.path.append(os.getcwd())
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+import pandas as pd
+
+from pytrade.backtest import Backtest
+from pytrade.datahandler import HistoricCSVDataHandler
+from pytrade.eventbus import DequeEventBus
+from pytrade.execution import SimulatedExecutionHandler
+from pytrade.performance import create_drawdowns
+from pytrade.portfolio import Portfolio
+from pytrade.sweep import ParameterSweep
+from synthetic import BenchmarkStrategy, write_universe
+
+# Metrics where a larger value is better; for all the others (times, memory) smaller is better
+HIGHER_IS_BETTER = ('bars_per_sec', 'events_per_sec', 'speedup')
+
+
+def best_of(func, repeat):
+    """
+    Returns the smallest wall time of repeat calls of func.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def make_backtest(data_dir, symbols, start_date=None, end_date=None):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return Backtest(data_dir, symbols, 100000.0, 0.0, start_date, end_date,
+                        HistoricCSVDataHandler, SimulatedExecutionHandler, Portfolio, BenchmarkStrategy)
+
+
+def bench_load(data_dir, symbols, repeat):
+    full = best_of(lambda: HistoricCSVDataHandler(DequeEventBus(), data_dir, symbols, None, None), repeat)
+    dates = HistoricCSVDataHandler(DequeEventBus(), data_dir, symbols, None, None).bar_datetimes
+    # The last 10% of the dates, read through the offset index (built by the first call)
+    start, end = dates[int(len(dates) * 0.9)], dates[-1]
+    HistoricCSVDataHandler(DequeEventBus(), data_dir, symbols, start, end)
+    window = best_of(lambda: HistoricCSVDataHandler(DequeEventBus(), data_dir, symbols, start, end), repeat)
+    return {'load_full_s': full, 'load_last_10pct_s': window}
+
+
+def bench_backtest(data_dir, symbols, repeat):
+    results = []
+    for _ in range(repeat):
+        backtest = make_backtest(data_dir, symbols)
+        start = time.perf_counter()
+        backtest._run_backtest()
+        elapsed = time.perf_counter() - start
+        bars = backtest.data_handler.bar_index
+        events = bars + backtest.signals + backtest.orders + backtest.fills
+        results.append((elapsed, bars, events))
+    elapsed, bars, events = min(results)
+    start = time.perf_counter()
+    backtest.portfolio.create_equity_curve_dataframe()
+    curve = time.perf_counter() - start
+    return {
+        'backtest_s': elapsed,
+        'bars': bars,
+        'events': events,
+        'bars_per_sec': bars / elapsed,
+        'events_per_sec': events / elapsed,
+        'equity_curve_s': curve,
+    }
+
+
+def bench_drawdowns(n, repeat):
+    rng = np.random.default_rng(0)
+    pnl = pd.Series(np.cumprod(1.0 + rng.normal(0.0003, 0.01, n)))
+    return {'drawdowns_n': n, 'drawdowns_s': best_of(lambda: create_drawdowns(pnl), repeat)}
+
+
+def bench_memory(data_dir, symbols):
+    tracemalloc.start()
+    backtest = make_backtest(data_dir, symbols)
+    backtest._run_backtest()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'peak_memory_mb': peak / 2**20}
+
+
+def bench_sweep(data_dir, symbols, workers):
+    grid = {'short_window': [5, 10, 15, 20], 'long_window': [40, 60]}
+    results = {}
+    base = None
+    for n in workers:
+        sweep = ParameterSweep(data_dir, symbols, 100000.0, None, None, SimulatedExecutionHandler,
+                               Portfolio, BenchmarkStrategy, grid, n_workers=n)
+        start = time.perf_counter()
+        sweep.run()
+        elapsed = time.perf_counter() - start
+        base = base or elapsed
+        results[f'sweep_{n}_workers_s'] = elapsed
+        results[f'sweep_{n}_workers_speedup'] = base / elapsed
+    return results
+
+
+def environment():
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def compare(results, baseline, threshold):
+    """
+    Prints the change of every metric against a baseline run and returns the
+    names of the metrics that got worse by more than threshold.
+    """
+    regressions = []
+    print("%-28s %14s %14s %8s" % ('metric', 'baseline', 'current', 'change'))
+    for name, value in results.items():
+        old = baseline.get(name)
+        if not isinstance(value, (int, float)) or not isinstance(old, (int, float)) or old == 0:
+            continue
+        change = value / old - 1.0
+        worse = -change if name.endswith(HIGHER_IS_BETTER) else change
+        flag = ' <-- regression' if worse > threshold and name.endswith(('_s', '_mb') + HIGHER_IS_BETTER) else ''
+        if flag:
+            regressions.append(name)
+        print("%-28s %14.6g %14.6g %+7.1f%%%s" % (name, old, value, change * 100.0, flag))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--symbols', type=int, default=10)
+    parser.add_argument('--bars', type=int, default=5000)
+    parser.add_argument('--freq', choices=['daily', 'minute'], default='daily')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--drawdown-size', type=int, default=1000000)
+    parser.add_argument('--workers', type=int, nargs='*', default=None,
+                        help='sweep pool sizes, default 1, 2, 4 up to the number of CPUs; none to skip')
+    parser.add_argument('--data-dir', default=None, help='keep the synthetic data there instead of a temp dir')
+    parser.add_argument('--output', default=None, help='JSON file, default benchmarks/results/bench_<time>.json')
+    parser.add_argument('--compare', default=None, help='JSON file of an earlier run')
+    parser.add_argument('--threshold', type=float, default=0.10, help='relative change counted as a regression')
+    args = parser.parse_args(argv)
+
+    workers = args.workers
+    if workers is None:
+        workers = [n for n in (1, 2, 4) if n <= (os.cpu_count() or 1)]
+
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix='pytrade_bench_')
+    try:
+        start = time.perf_counter()
+        symbols = write_universe(data_dir, args.symbols, args.bars, args.freq)
+        print("Generated %d x %d %s bars in %.1fs" % (args.symbols, args.bars, args.freq, time.perf_counter() - start))
+
+        results = {}
+        results.update(bench_load(data_dir, symbols, args.repeat))
+        results.update(bench_backtest(data_dir, symbols, args.repeat))
+        results.update(bench_drawdowns(args.drawdown_size, args.repeat))
+        results.update(bench_memory(data_dir, symbols))
+        if workers:
+            results.update(bench_sweep(data_dir, symbols, workers))
+    finally:
+        if args.data_dir is None:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    for name, value in results.items():
+        print("%-28s %14.6g" % (name, value))
+
+    output = args.output or os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), 'results',
+        'bench_%s.json' % datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump({'environment': environment(), 'config': vars(args), 'results': results}, f, indent=2)
+    print("Results written to %s" % output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        for key in ('symbols', 'bars', 'freq'):
+            if baseline['config'].get(key) != getattr(args, key):
+                print("Warning: the baseline ran with %s=%s" % (key, baseline['config'].get(key)))
+        regressions = compare(results, baseline['results'], args.threshold)
+        if regressions:
+            print("Regressions: %s" % ', '.join(regressions))
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
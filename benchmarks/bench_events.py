@@ -0,0 +1,108 @@
+"""
+Per-event overhead of the event objects and of the engine's dispatch.
+
+Compares the current __slots__ events and dispatch table with a replica of the
+previous plain classes (instance __dict__, string type tags) dispatched by an
+if/elif chain on strings. Run from the repository root:
+
+    python benchmarks/bench_events.py
+"""
+import os
+import sys
+import timeit
+import tracemalloc
+sys.path.append(os.getcwd())
+
+from pytrade.event import EventType, MarketEvent, SignalEvent, OrderEvent, FillEvent
+
+
+class LegacySignalEvent(object):
+    def __init__(self, strategy_id, symbol, datetime, signal_type, strength):
+        self.type = 'SIGNAL'
+        self.strategy_id = strategy_id
+        self.symbol = symbol
+        self.datetime = datetime
+        self.signal_type = signal_type
+        self.strength = strength
+
+
+class LegacyOrderEvent(object):
+    def __init__(self, symbol, order_type, quantity, direction):
+        self.type = 'ORDER'
+        self.symbol = symbol
+        self.order_type = order_type
+        self.quantity = quantity
+        self.direction = direction
+
+
+class LegacyFillEvent(object):
+    def __init__(self, timeindex, symbol, exchange, quantity, direction, fill_cost, commission):
+        self.type = 'FILL'
+        self.timeindex = timeindex
+        self.symbol = symbol
+        self.exchange = exchange
+        self.quantity = quantity
+        self.direction = direction
+        self.commission = commission
+
+
+class LegacyMarketEvent(object):
+    def __init__(self):
+        self.type = 'MARKET'
+
+
+def make_events(market, signal, order, fill, n):
+    events = []
+    for i in range(n):
+        events.append(market())
+        events.append(signal(1, 'AAPL', None, 'LONG', 1.0))
+        events.append(order('AAPL', 'MKT', 100, 'BUY'))
+        events.append(fill(None, 'AAPL', 'ARCA', 100, 'BUY', None, 1.3))
+    return events
+
+
+def make_handlers(counts):
+    def on_market(e): counts[0] += 1
+    def on_signal(e): counts[1] += 1
+    def on_order(e): counts[2] += 1
+    def on_fill(e): counts[3] += 1
+    return on_market, on_signal, on_order, on_fill
+
+
+def legacy_dispatch(events, counts):
+    on_market, on_signal, on_order, on_fill = make_handlers(counts)
+    for event in events:
+        if event.type == 'MARKET':
+            on_market(event)
+        elif event.type == 'SIGNAL':
+            on_signal(event)
+        elif event.type == 'ORDER':
+            on_order(event)
+        elif event.type == 'FILL':
+            on_fill(event)
+
+
+def table_dispatch(events, counts):
+    on_market, on_signal, on_order, on_fill = make_handlers(counts)
+    handlers = {EventType.MARKET: on_market, EventType.SIGNAL: on_signal,
+                EventType.ORDER: on_order, EventType.FILL: on_fill}
+    for event in events:
+        handlers[event.type](event)
+
+
+def measure(label, classes, dispatch, n=100000, repeat=5):
+    create = min(timeit.repeat(lambda: make_events(*classes, n), number=1, repeat=repeat))
+    tracemalloc.start()
+    events = make_events(*classes, n)
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    counts = [0, 0, 0, 0]
+    run = min(timeit.repeat(lambda: dispatch(events, counts), number=1, repeat=repeat))
+    num = len(events)
+    print("%-8s create %6.0f ns/event  dispatch %6.0f ns/event  memory %4.0f B/event"
+          % (label, create / num * 1e9, run / num * 1e9, memory / num))
+
+
+if __name__ == "__main__":
+    measure('legacy', (LegacyMarketEvent, LegacySignalEvent, LegacyOrderEvent, LegacyFillEvent), legacy_dispatch)
+    measure('slots', (MarketEvent, SignalEvent, OrderEvent, FillEvent), table_dispatch)
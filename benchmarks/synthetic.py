@@ -0,0 +1,94 @@
+"""
+Synthetic OHLCV data for the benchmarks: geometric random walks written in the
+same CSV layout as data/AAPL.csv, so every data handler reads them unchanged.
+"""
+import os
+import sys
+sys.path.append(os.getcwd())
+
+import numpy as np
+import pandas as pd
+
+from pytrade.event import SignalEvent
+from pytrade.indicators import SMA
+from pytrade.strategy import Strategy
+
+CSV_HEADER = ['Date', 'Open', 'High', 'Low', 'Close', 'Volumn', 'Adj Close']
+
+
+def make_calendar(n_bars, freq='daily', start='2000-01-03'):
+    """
+    Returns n_bars timestamps: business days for 'daily', or the 390 one-minute
+    bars of 09:30-16:00 on each business day for 'minute'.
+    """
+    if freq == 'daily':
+        return pd.bdate_range(start, periods=n_bars)
+    if freq == 'minute':
+        days = pd.bdate_range(start, periods=n_bars // 390 + 1)
+        minutes = pd.timedelta_range('09:30:00', periods=390, freq='min')
+        return (days.values[:, None] + minutes.values[None, :]).ravel()[:n_bars]
+    raise ValueError(f"Unknown frequency {freq}, expected 'daily' or 'minute'")
+
+
+def generate_ohlcv(n_bars, freq='daily', seed=0, start='2000-01-03'):
+    """
+    Returns a DataFrame of n_bars OHLCV bars following a geometric random walk,
+    with the columns of the CSV files.
+    """
+    rng = np.random.default_rng(seed)
+    vol = 0.02 if freq == 'daily' else 0.001
+    close = 50.0 * np.exp(np.cumsum(rng.normal(0.0, vol, n_bars)))
+    open_ = close * np.exp(rng.normal(0.0, vol / 4, n_bars))
+    spread = np.abs(rng.normal(0.0, vol / 2, (2, n_bars)))
+    high = np.maximum(open_, close) * (1.0 + spread[0])
+    low = np.minimum(open_, close) * (1.0 - spread[1])
+    volume = rng.integers(10000, 1000000, n_bars)
+    return pd.DataFrame({
+        'Date': pd.DatetimeIndex(make_calendar(n_bars, freq, start)).strftime(
+            '%Y-%m-%d' if freq == 'daily' else '%Y-%m-%d %H:%M:%S'),
+        'Open': open_.round(4), 'High': high.round(4), 'Low': low.round(4), 'Close': close.round(4),
+        'Volumn': volume, 'Adj Close': close,
+    }, columns=CSV_HEADER)
+
+
+def write_universe(directory, n_symbols, n_bars, freq='daily', seed=0):
+    """
+    Writes <directory>/SYM0000.csv ... for n_symbols symbols and returns the symbol list.
+    """
+    os.makedirs(directory, exist_ok=True)
+    symbols = ['SYM%04d' % i for i in range(n_symbols)]
+    for i, s in enumerate(symbols):
+        generate_ohlcv(n_bars, freq, seed + i).to_csv(os.path.join(directory, f'{s}.csv'), index=False)
+    return symbols
+
+
+class BenchmarkStrategy(Strategy):
+    """
+    Moving average cross over every symbol, sending TARGET signals, so a run
+    exercises the indicators, the signal/order/fill path and the Portfolio.
+    """
+    def __init__(self, bars, account, events, short_window=10, long_window=40):
+        self.bars = bars
+        self.events = events
+        self.symbol_list = self.bars.symbol_list
+        self.short_window = short_window
+        self.long_window = long_window
+        self.long = dict((s, False) for s in self.symbol_list)
+        for s in self.symbol_list:
+            self.bars.register_indicator(s, f'sma{short_window}', SMA(short_window))
+            self.bars.register_indicator(s, f'sma{long_window}', SMA(long_window))
+
+    def calculate_signals(self, event):
+        for s in self.symbol_list:
+            short = self.bars.get_indicator(s, f'sma{self.short_window}')
+            long = self.bars.get_indicator(s, f'sma{self.long_window}')
+            if short > long and not self.long[s]:
+                self.long[s] = True
+                target = 100
+            elif short < long and self.long[s]:
+                self.long[s] = False
+                target = 0
+            else:
+                continue
+            self.events.put(SignalEvent(self.strategy_id, s, self.bars.get_latest_bar_datetime(s),
+                                        'TARGET', 1.0, target_quantity=target))
@@ -13,15 +13,14 @@ from pytrade.backtest import Backtest
 from pytrade.datahandler import HistoricCSVDataHandler
 from pytrade.execution import SimulatedExecutionHandler
 from pytrade.portfolio import Portfolio
-
-import statsmodels.api as sm
+from pytrade.indicators import RollingPairsOLS
 
 
 """
 1. Long hte market and below the negative 
 """
 
-class IntradayOLSMRStrategy(strategy):
+class IntradayOLSMRStrategy(Strategy):
     """
     Uses ordinary least squares (OLS) to perform a rolling linear regresssion to determine the hedge ratio
     between a pair of equities. The z-score of the residuals time series is then calculated in a rolling
@@ -29,7 +28,7 @@ class IntradayOLSMRStrategy(strategy):
     are generated for the high threshold or an exit signal pair are generated (for the low threshold).
     """
     def __init__(self, bars, account, events, ols_window=100,
-                 zcore_low=0.5, zscore_high=3.0):
+                 zscore_low=0.5, zscore_high=3.0):
         """
         Initialises the stat arb strategy.
         
@@ -43,12 +42,13 @@ class IntradayOLSMRStrategy(strategy):
         self.symbol_list = self.bars.symbol_list
         self.account = account
         self.events = events
-        self.ols_window = ols_windows
+        self.ols_window = ols_window
         self.zscore_low = zscore_low
         self.zscore_high = zscore_high
 
         self.pair = ('AREX', 'WLL')
-        self.datetime = datetime.utcnow()
+        # 对冲比例和残差zscore由running sums增量计算, 不用每个bar都跑sm.OLS
+        self.ols = RollingPairsOLS([self.pair], self.ols_window)
         
         self.long_market = False
         self.short_market = False
@@ -67,38 +67,38 @@ class IntradayOLSMRStrategy(strategy):
         x_signal = None
         p0 = self.pair[0]
         p1 = self.pair[1]
-        cur_dt = self.datetime
+        cur_dt = self.bars.get_latest_bar_datetime(p0) # bar time
         hr = abs(self.hedge_ratio)
         # 当残差
         if zscore_last <= -self.zscore_high and not self.long_market:
             self.long_market = True
-            y_signal = SignalEvent(1, p0, cur_dt, 'LONG', 1.0)
-            x_signal = SignalEvent(1, p1, cur_dt, 'SHORT', hr)
+            y_signal = SignalEvent(self.strategy_id, p0, cur_dt, 'LONG', 1.0)
+            x_signal = SignalEvent(self.strategy_id, p1, cur_dt, 'SHORT', hr)
         # If we're long the market and between the absolute value of the low zscore threshold
         
         if abs(zscore_last) <= self.zscore_low and self.long_market:
             self.long_market = False
-            y_signal = SignalEvent(1, p0, cur_dt, 'EXIT', 1.0)
-            x_signal = SignalEvent(1, p1, cur_dt, 'EXIT', 1.0)
+            y_signal = SignalEvent(self.strategy_id, p0, cur_dt, 'EXIT', 1.0)
+            x_signal = SignalEvent(self.strategy_id, p1, cur_dt, 'EXIT', 1.0)
             
         # If we're short the market and above the high zscore threshold
         if zscore_last >= self.zscore_high and not self.short_market:
             self.short_market = True
-            y_signal = SignalEvent(1, p0, cur_dt, 'SHORT', 1.0)
-            x_signal = SignalEvent(1, p1, cur_dt, 'LONG', hr)
+            y_signal = SignalEvent(self.strategy_id, p0, cur_dt, 'SHORT', 1.0)
+            x_signal = SignalEvent(self.strategy_id, p1, cur_dt, 'LONG', hr)
         
         # If we're short the market and above the high zscore threshold
         if zscore_last >= self.zscore_high and not self.short_market:
             self.short_market = True
-            y_signal = SignalEvent(1, p0, cur_dt, 'SHORT', 1.0)
-            x_signal = SignalEvent(1, p1, cur_dt, 'LONG', hr)
+            y_signal = SignalEvent(self.strategy_id, p0, cur_dt, 'SHORT', 1.0)
+            x_signal = SignalEvent(self.strategy_id, p1, cur_dt, 'LONG', hr)
         
         # If we're short the market and between the absolute value of 
         # the low zscore threshold
         if abs(zscore_last) <= self.zscore_low and self.short_market:
             self.short_market = False
-            y_signal = SignalEvent(1, p0, cur_dt, 'EXIT', 1.0)
-            x_signal = SignalEvent(1, p1, cur_dt, 'EXIT', 1.0)
+            y_signal = SignalEvent(self.strategy_id, p0, cur_dt, 'EXIT', 1.0)
+            x_signal = SignalEvent(self.strategy_id, p1, cur_dt, 'EXIT', 1.0)
         
         return y_signal, x_signal
             
@@ -107,28 +107,24 @@ class IntradayOLSMRStrategy(strategy):
         Generates a new set of signals based on teh mean reversion strategu.
         
         Calculates the hedge ratio between the pair of tickers.
-        We use OLS for this, although we could use CADF.
+        We use a rolling OLS for this, although we could use CADF.
         """
-        # Obtain the latest window of values for each
-        # component of the pair of tickers
-        y = self.bars.get_latest_bars_values(self.pair[0], 'close', N=self.ols_window)
-        x = self.bars.get_latest_bars_values(self.pair[1], 'close', N=self.ols_window)
+        # Add the latest values of the pair to the rolling regression
+        self.ols.update_from_bars(self.bars, 'close')
         
-        if y is not None and x is not None:
-            # Check that all window periods are available.
-            if len(y) >= self.ols_window and len(x) >= self.ols_window:
-                # Calculate the current hedge ratio using OLS
-                self.hedge_ratio = sm.OLS(y,x).fit().params[0]
-                
-                # Calculate the current z-score of the residuals
-                spread = y - self.hedge_ratio * x
-                zscore_last = ((spread - spread.mean()) / spread.std())[-1]
-                
-                # Calculate signals and add to events queue
-                y_signal, x_signal = self.calculate_xy_signals(zscore_last)
-                if y_signal is not None and x_signal is not None:
-                    self.events.put(y_signal)
-                    self.events.put(x_signal)
+        # Check that all window periods are available.
+        if self.ols.count >= self.ols_window:
+            # Current hedge ratio of the OLS of y on x
+            self.hedge_ratio = self.ols.beta[0]
+            
+            # Current z-score of the residuals
+            zscore_last = self.ols.residual_zscore()[0]
+            
+            # Calculate signals and add to events queue
+            y_signal, x_signal = self.calculate_xy_signals(zscore_last)
+            if y_signal is not None and x_signal is not None:
+                self.events.put(y_signal)
+                self.events.put(x_signal)
     
     def calculate_signals(self, event):
         """
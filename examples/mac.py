@@ -7,12 +7,13 @@ import numpy as np
 from alpha_vantage import AlphaVantage
 import queue
 
-from pytrade.strategy import Strategy
+from pytrade.strategy import Strategy, VectorizedStrategy
 from pytrade.event import SignalEvent
-from pytrade.backtest import Backtest
+from pytrade.backtest import Backtest, VectorizedBacktest
 from pytrade.datahandler import HistoricCSVDataHandler
 from pytrade.execution import SimulatedExecutionHandler
 from pytrade.portfolio import Portfolio
+from pytrade.indicators import SMA
 
 # Entry signals are only generated if the attribute bought is "Out", and exit signals are only ever generated if this is "LONG"
 # or "SHORT".
@@ -48,6 +49,11 @@ class MovingAverageCrossStrategy(Strategy):
         
         # Set to True if a symbol is in the market
         self.bought = self._calculate_initial_bought()
+
+        # 均线由DataHandler在每个bar上增量更新
+        for s in self.symbol_list:
+            self.bars.register_indicator(s, f'sma{self.short_window}', SMA(self.short_window))
+            self.bars.register_indicator(s, f'sma{self.long_window}', SMA(self.long_window))
         
     def _calculate_initial_bought(self):
         """
@@ -68,33 +74,66 @@ class MovingAverageCrossStrategy(Strategy):
         """
         if event.type == "MARKET":
             for s in self.symbol_list:
-                bars = self.bars.get_latest_bars_values(s, 'adj_close', N = self.long_window) # array
                 bar_date = self.bars.get_latest_bar_datetime(s)
-                if  bars is not None: #FIXME: 修改判定方式
-                    short_sma = np.mean(bars[-self.short_window:])
-                    long_sma = np.mean(bars[-self.long_window:])
-                    
-                    symbol = s
-                    cur_date = datetime.utcnow() #FIXME: 注意时间
-                    sig_dir = ""
-                    # 只有当条件满足时才会产生信号, 
-                    if short_sma > long_sma and self.bought[symbol] == "OUT":
-                        print("LONG: %s" % bar_date)
-                        sig_dir = 'LONG'
-                        cash = self.account.current_holdings['cash'] # 注意是我们是以昨天的收盘价成交的
-                        price = self.bars.get_latest_bar_value(s, 'adj_close')
-                        n = int(0.8 * cash / price / 100)
-                        signal = SignalEvent(1, symbol, cur_date, sig_dir, 1.0) # 一手
-                        for i in range(n):
-                            self.events.put(signal) # 连续下单
-                        self.bought[s] = 'LONG'
-                    # 短均线下穿长均线且处于long状态, 那么退出市场
-                    elif short_sma < long_sma and self.bought[symbol] == "LONG":
-                        print("SHORT: %s" % bar_date)
-                        sig_dir = "EXIT"
-                        signal = SignalEvent(1, symbol, cur_date, sig_dir, 1.0)
-                        self.events.put(signal) 
-                        self.bought[s] = "OUT"
+                short_sma = self.bars.get_indicator(s, f'sma{self.short_window}')
+                long_sma = self.bars.get_indicator(s, f'sma{self.long_window}')
+                symbol = s
+                cur_date = bar_date
+                sig_dir = ""
+                # 只有当条件满足时才会产生信号, 
+                if short_sma > long_sma and self.bought[symbol] == "OUT":
+                    print("LONG: %s" % bar_date)
+                    sig_dir = 'TARGET'
+                    cash = self.account.current_holdings['cash'] # 注意是我们是以昨天的收盘价成交的
+                    price = self.bars.get_latest_bar_value(s, 'adj_close')
+                    n = int(0.8 * cash / price / 100)
+                    # 一次下n手, 一个信号一个订单
+                    signal = SignalEvent(self.strategy_id, symbol, cur_date, sig_dir, 1.0, target_quantity=100 * n)
+                    self.events.put(signal)
+                    self.bought[s] = 'LONG'
+                # 短均线下穿长均线且处于long状态, 那么退出市场
+                elif short_sma < long_sma and self.bought[symbol] == "LONG":
+                    print("SHORT: %s" % bar_date)
+                    sig_dir = "EXIT"
+                    signal = SignalEvent(self.strategy_id, symbol, cur_date, sig_dir, 1.0)
+                    self.events.put(signal) 
+                    self.bought[s] = "OUT"
+
+
+class VectorizedMovingAverageCrossStrategy(VectorizedStrategy):
+    """
+    The moving average cross strategy above, written for the VectorizedBacktest.
+    Positions are sized from the initial capital instead of the current cash,
+    so it is a fast approximation of the event-driven version.
+    """
+    def __init__(self, bars, short_window=50, long_window=200, initial_capital=100000.0):
+        """
+        Parameters:
+        ----------------------------------
+        bars: DataHandler object
+        short_window = The short moving average lookback
+        long_window = The long moving average lookback
+        initial_capital = The capital used to size the entries
+        """
+        self.bars = bars
+        self.short_window = short_window
+        self.long_window = long_window
+        self.initial_capital = initial_capital
+
+    def generate_target_positions(self, prices):
+        short_sma = prices.rolling(self.short_window, min_periods=1).mean()
+        long_sma = prices.rolling(self.long_window, min_periods=1).mean()
+
+        # 1 above, 0 below, keep the previous state when equal
+        state = pd.DataFrame(np.nan, index=prices.index, columns=prices.columns)
+        state[short_sma > long_sma] = 1.0
+        state[short_sma < long_sma] = 0.0
+        in_market = state.ffill().fillna(0.0).astype(bool)
+
+        # Buy 80% of capital in lots of 100 at the entry bar and hold until the exit
+        entry = in_market & ~in_market.shift(1, fill_value=False)
+        lots = np.floor(0.8 * self.initial_capital / prices / 100) * 100
+        return lots.where(entry).ffill().where(in_market, 0.0)
 
 
 if __name__ == "__main__":
@@ -120,4 +159,11 @@ if __name__ == "__main__":
                         Portfolio, 
                         MovingAverageCrossStrategy)
     backtest.simulate_trading()
+
+    # 向量化版本, 用于快速比较
+    vectorized = VectorizedBacktest(csv_dir, symbol_list, initial_capital, start_date, end_date,
+                                    HistoricCSVDataHandler,
+                                    VectorizedMovingAverageCrossStrategy,
+                                    {'initial_capital': initial_capital})
+    vectorized.simulate_trading()
     
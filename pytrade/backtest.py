@@ -1,20 +1,40 @@
 import datetime
+import inspect
+
+import numpy as np
+import pandas as pd
+
+from . import checkpoint
+from .clock import SimulatedClock
+from .event import EventType, calculate_ib_commission
+from .eventbus import DequeEventBus
+from .performance import create_sharpe_ratio, create_drawdowns
+
+
+def _accepts_keyword(cls, name):
+    """
+    Returns True if cls(...) takes the keyword argument name, or any keyword.
+    """
+    params = inspect.signature(cls).parameters.values()
+    return any(p.name == name and p.kind != p.POSITIONAL_ONLY or p.kind == p.VAR_KEYWORD for p in params)
 
-try:
-    import Queue as queue
-except ImportError:
-    import queue
-import time
 
 class Backtest(object):
     """
     Enscapsulates the settings and components for carying out 
     an event-driven backtest.
+
+    The SignalEvents of a bar are collected and sized together, with one
+    Portfolio.generate_orders() call per portfolio once the queue is empty.
+
+    A run can be saved between two bars with save_checkpoint() (or every N bars,
+    see simulate_trading()) and continued later from Backtest.load_checkpoint().
     """
     
     def __init__(self, csv_dir, symbol_list, initial_capital,
                  heartbeat, start_date, end_date, data_handler, execution_handler,
-                 portfolio, strategy):
+                 portfolio, strategy, strategy_params=None, event_bus=DequeEventBus,
+                 clock=SimulatedClock, fee_schedule=None, instrumentation=None):
         """
         Initialises the backtest.
         
@@ -26,8 +46,19 @@ class Backtest(object):
         heartbeat: 
         start_date : 
         data_handler : DataHandler Class
-        execution_handler: Class
+        execution_handler: ExecutionHandler Class, built with (events, clock=clock) if it takes
+        a clock keyword, else with (events) only and given the clock as .clock
         portfolio: Portfolio Class
+        strategy: Strategy Class, or a list of Strategy Classes run side by side
+        strategy_params: dict of keyword arguments for the strategy, e.g. {'short_window': 50},
+        or a list of such dicts (one per strategy) when strategy is a list
+        event_bus: EventBus Class, the single-threaded DequeEventBus by default
+        clock: Clock Class. The default SimulatedClock runs on bar time and never
+        sleeps; use WallClock for paper trading, where heartbeat is the pause between bars.
+        fee_schedule: fees.FeeSchedule charged on the fills by the execution handler and
+        on the positions by the portfolios; None keeps the IB commission on fills.
+        instrumentation: profiling.Instrumentation collecting handler and component
+        timings, or None to run without any instrumentation overhead.
         """
         self.csv_dir = csv_dir
         self.symbol_list = symbol_list
@@ -40,33 +71,169 @@ class Backtest(object):
         self.strategy_cls = strategy
         self.portfolio_cls = portfolio
         self.execution_handler_cls = execution_handler
+        self.clock_cls = clock
+        self.fee_schedule = fee_schedule
+        self.instrumentation = instrumentation
+        if isinstance(strategy, (list, tuple)):
+            self.strategy_classes = list(strategy)
+            self.strategy_params_list = list(strategy_params or [{}] * len(strategy))
+        else:
+            self.strategy_classes = [strategy]
+            self.strategy_params_list = [strategy_params or {}]
+        if len(self.strategy_params_list) != len(self.strategy_classes):
+            raise ValueError("strategy_params needs one dict per strategy")
+        self.strategy_params = self.strategy_params_list[0]
         
-        self.events = queue.Queue()
+        self.events = event_bus()
         
         self.signals = 0
         self.orders = 0
         self.fills = 0
-        self.num_strats = 1 #TODO: 修改策略数量
+        self.num_strats = len(self.strategy_classes)
+        self._pending_signals = {} # portfolio -> SignalEvents of the current bar
         
         self._generate_trading_instances()
+
+        if self.instrumentation is not None:
+            self._instrument_components()
+        self._register_handlers()
         
         
     def _generate_trading_instances(self):
         """
-        Generates the trading instance objects from their class types
+        Generates the trading instance objects from their class types.
+
+        All the strategies share the data handler (one pass over the data, one bar
+        cursor, shared indicators) and the execution handler. Each one gets its own
+        Portfolio with initial_capital, and strategy_id 1, 2, ... in the order given;
+        signals, orders and fills are routed to the portfolio of their strategy_id.
         """
         print("Creating DataHandler, Strategy, Portfolio and ExecutionHandler")
         self.data_handler = self.data_handler_cls(self.events, self.csv_dir, self.symbol_list, self.start_date, self.end_date)
-        self.portfolio = self.portfolio_cls(self.data_handler, self.events, self.start_date, self.initial_capital)
-        self.execution_handler = self.execution_handler_cls(self.events) 
-        self.strategy = self.strategy_cls(self.data_handler, self.portfolio, self.events)
-        
-    def _run_backtest(self):
+        self.clock = self.clock_cls(self.data_handler, self.heartbeat)
+        self._generate_accounts(self.start_date)
+
+    def _generate_accounts(self, start_date):
+        """
+        Generates the execution handler, and one Portfolio starting at start_date
+        and one Strategy per strategy class, on the existing data handler.
+        """
+        if _accepts_keyword(self.execution_handler_cls, 'clock'):
+            self.execution_handler = self.execution_handler_cls(self.events, clock=self.clock)
+        else: # e.g. IBexecutionHandler(events, order_routing, currency)
+            self.execution_handler = self.execution_handler_cls(self.events)
+            self.execution_handler.clock = self.clock
+        if self.fee_schedule is not None:
+            self.execution_handler.fee_schedule = self.fee_schedule
+        self.portfolios = {}
+        self.strategies = {}
+        for strategy_id, (strategy_cls, params) in enumerate(zip(self.strategy_classes, self.strategy_params_list), 1):
+            portfolio = self.portfolio_cls(self.data_handler, self.events, start_date, self.initial_capital)
+            if self.fee_schedule is not None:
+                portfolio.fee_schedule = self.fee_schedule
+            portfolio.execution_handler = self.execution_handler
+            portfolio.strategy_id = strategy_id if self.num_strats > 1 else None
+            strategy = strategy_cls(self.data_handler, portfolio, self.events, **params)
+            strategy.strategy_id = strategy_id
+            self.portfolios[strategy_id] = portfolio
+            self.strategies[strategy_id] = strategy
+        self.portfolio = self.portfolios[1]
+        self.strategy = self.strategies[1]
+        self._strategy_list = list(self.strategies.values())
+        self._portfolio_list = list(self.portfolios.values())
         
-        i = 0
+    def _register_handlers(self):
+        """
+        Registers the handler of each event type on the event bus.
+        """
+        handlers = [
+            (EventType.MARKET, self._on_market),
+            (EventType.SIGNAL, self._on_signal),
+            (EventType.ORDER, self._on_order),
+            (EventType.FILL, self._on_fill),
+        ]
+        for event_type, handler in handlers:
+            if self.instrumentation is not None:
+                handler = self.instrumentation.wrap_handler(event_type, handler, self.events)
+            self.events.register(event_type, handler)
+
+    def _instrument_components(self):
+        """
+        Replaces the hot methods of the components by timed wrappers.
+        """
+        inst = self.instrumentation
+        update_bars = inst.wrap('component', 'update_bars', self.data_handler.update_bars)
+
+        def new_bar():
+            inst.new_bar()
+            update_bars()
+        self.data_handler.update_bars = new_bar
+        for strategy in self._strategy_list:
+            strategy.calculate_signals = inst.wrap('component', 'calculate_signals', strategy.calculate_signals)
+        for portfolio in self._portfolio_list:
+            portfolio.update_timeindex = inst.wrap('component', 'update_timeindex', portfolio.update_timeindex)
+            portfolio.update_fill = inst.wrap('component', 'update_fill', portfolio.update_fill)
+
+    def _portfolio_of(self, event):
+        """
+        Returns the portfolio of the event's strategy_id. With a single strategy
+        every event goes to its portfolio, whatever id the strategy put on it.
+        """
+        if self.num_strats == 1:
+            return self.portfolio
+        portfolio = self.portfolios.get(event.strategy_id)
+        if portfolio is None:
+            print(f"No strategy with strategy_id {event.strategy_id}, event dropped")
+        return portfolio
+
+    def _on_market(self, event):
+        self.execution_handler.on_market(event) # 先撮合挂单
+        for strategy in self._strategy_list:
+            strategy.calculate_signals(event) #MARK: 放入SignalEvent
+        for portfolio in self._portfolio_list:
+            portfolio.update_timeindex(event) # append当前的holdings
+
+    def _on_signal(self, event):
+        self.signals += 1
+        portfolio = self._portfolio_of(event)
+        if portfolio is not None:
+            self._pending_signals.setdefault(portfolio, []).append(event) # bar结束时一起生成订单
+
+    def _flush_signals(self):
+        """
+        Sizes the signals collected since the last call, one generate_orders()
+        call per portfolio, which puts the OrderEvents on the queue.
+        """
+        pending, self._pending_signals = self._pending_signals, {}
+        for portfolio, signals in pending.items():
+            portfolio.update_signals(signals) #MARK: 放入OrderEvent
+
+    def _on_order(self, event):
+        self.orders += 1
+        self.execution_handler.execute_order(event) #MARK 放入FillEvent
+
+    def _on_fill(self, event):
+        self.fills += 1
+        portfolio = self._portfolio_of(event)
+        if portfolio is not None:
+            portfolio.update_fill(event) # 因为市值是估计的期末的价值。
+
+    def _run_backtest(self, until=None, checkpoint_path=None, checkpoint_every=None):
+        """
+        Runs the event loop until the end of the data.
+
+        Parameters:
+        until: stop once the bar at or after this datetime has been handled, so
+        that the run can be checkpointed and continued from there
+        checkpoint_path, checkpoint_every: save a checkpoint to checkpoint_path every checkpoint_every bars
+        """
+        if until is not None:
+            until = pd.Timestamp(until)
+        bars = 0
         while True:
-            i += 1
-            print(i)
+            if until is not None and self.data_handler.bar_index > 0 and \
+                    self.data_handler.get_latest_bar_datetime(self.symbol_list[0]) >= until:
+                break
             # Update the market bars
             if self.data_handler.continue_backtest == True:
                 self.data_handler.update_bars() # MARK: 更新bar, 放入MarketEvent, 需要值得注意的是, 在取完数据后, 整体还需要运行一次,才会出现continue_backtest
@@ -75,54 +242,287 @@ class Backtest(object):
             else:
                 break
             # Handle the events
-            # 注意这个while循环，表示一个bar内的操作。当loop1只执行一个MarketEvent, 然后放入SignalEvent, loop2就会开始这行这些SignalEvent，然后...
-            while True:
-                try:
-                    event = self.events.get(False) 
-                except queue.Empty:
-                    break
-                else:
-                    if event is not None:
-                        if event.type == 'MARKET':
-                            self.strategy.calculate_signals(event) #MARK: 放入SignalEvent
-                            self.portfolio.update_timeindex(event) # append当前的holdings
-                        
-                        elif event.type == 'SIGNAL':
-                            self.signals += 1
-                            self.portfolio.update_signal(event) #MARK: 放入OrderEvent
+            # 注意dispatch_pending会一直处理到队列为空，表示一个bar内的操作。先处理MarketEvent, 然后放入SignalEvent, 再处理这些SignalEvent，然后...
+            self.events.dispatch_pending()
+            # 这个bar的所有信号都到齐后, 每个portfolio一次性生成订单, 再处理订单和成交
+            while self._pending_signals:
+                self._flush_signals()
+                self.events.dispatch_pending()
                             
-                        elif event.type == 'ORDER':
-                            self.orders += 1 
-                            self.execution_handler.execute_order(event) #MARK 放入FillEvent
+            self.clock.wait() # 休息一下, 回测时什么也不做
 
-                        elif event.type == 'FILL':
-                            self.fills += 1
-                            self.portfolio.update_fill(event) # 因为市值是估计的期末的价值。
-                            
-            time.sleep(self.heartbeat) # 休息一下
+            if checkpoint_every is not None:
+                bars += 1
+                if bars % checkpoint_every == 0:
+                    self.save_checkpoint(checkpoint_path) # bar之间事件队列为空
             
+    def save_checkpoint(self, path):
+        """
+        Saves the state of the run to path: the data handler cursor and
+        indicators, the execution handler, the portfolios with their ledgers,
+        the strategies and the pending events. The bars themselves are not
+        saved but read again by the data handler on loading.
+
+        Every component must be picklable; strategies and other classes are
+        saved by reference, so they must be importable where the checkpoint is loaded.
+        """
+        if self.instrumentation is not None:
+            raise ValueError("A Backtest with instrumentation cannot be checkpointed")
+        header = {
+            'data_handler': checkpoint.class_name(type(self.data_handler)),
+            'bar_index': self.data_handler.bar_index,
+            'datetime': self.data_handler.get_latest_bar_datetime(self.symbol_list[0]) if self.data_handler.bar_index else None,
+        }
+        checkpoint.save_checkpoint(self, path, header)
+
+    @classmethod
+    def load_checkpoint(cls, source, strategy=None, strategy_params=None, data_handler=None):
+        """
+        Loads a Backtest saved by save_checkpoint(). simulate_trading() on it
+        continues the run from the bar it was saved at.
+
+        If strategy or strategy_params is given, the checkpoint is forked instead:
+        the data handler keeps its cursor and warmed-up indicators, while the
+        execution handler, portfolios (with initial_capital, starting at the
+        checkpoint's bar) and strategies are created anew, e.g. to run several
+        variants from one warm-up.
+
+        Parameters:
+        source: path or binary file object
+        strategy: Strategy Class or list of Classes of the fork, the saved ones by default
+        strategy_params: dict (or list of dicts) of keyword arguments of the fork's strategies
+        data_handler: DataHandler Class to reload the bars with instead of the saved one
+        """
+        classes = {}
+        if data_handler is not None:
+            classes[tuple(checkpoint.read_header(source)['data_handler'])] = data_handler
+            if hasattr(source, 'seek'):
+                source.seek(0)
+        header, backtest = checkpoint.load_checkpoint(source, classes)
+        if data_handler is not None:
+            backtest.data_handler_cls = data_handler
+        if strategy is not None or strategy_params is not None:
+            backtest._fork(strategy, strategy_params)
+        return backtest
+
+    def _fork(self, strategy=None, strategy_params=None):
+        """
+        Replaces the accounts and strategies by new ones starting at the current
+        bar, keeping the market data state.
+        """
+        if strategy is not None:
+            self.strategy_cls = strategy
+            self.strategy_classes = list(strategy) if isinstance(strategy, (list, tuple)) else [strategy]
+        if strategy_params is None:
+            strategy_params = [{}] * len(self.strategy_classes)
+        elif not isinstance(strategy_params, (list, tuple)):
+            strategy_params = [strategy_params]
+        if len(strategy_params) != len(self.strategy_classes):
+            raise ValueError("strategy_params needs one dict per strategy")
+        self.strategy_params_list = list(strategy_params)
+        self.strategy_params = self.strategy_params_list[0]
+        self.num_strats = len(self.strategy_classes)
+        self.signals = 0
+        self.orders = 0
+        self.fills = 0
+        if self.data_handler.bar_index > 0:
+            self._generate_accounts(self.data_handler.get_latest_bar_datetime(self.symbol_list[0]))
+        else:
+            self._generate_accounts(self.start_date)
+
     def _output_performance(self):
         """
-        Outputs the strategy performance from the backtest.
+        Outputs the strategy performance from the backtest, one block per
+        strategy when several are run (their equity curves are written to
+        equity_<strategy_id>.csv).
         """
-        self.portfolio.create_equity_curve_dataframe()
-        
-        print("Creating summary stats ... ")
-        stats = self.portfolio.output_summary_stats()
-        print("Creating equity curve ...")
-        print(self.data_handler.latest_symbol_data['AAPL'][-1:])
-        print(self.portfolio.equity_curve.head(10))
-        print(self.portfolio.equity_curve.tail(10))
-        print(stats)
+        for strategy_id, portfolio in self.portfolios.items():
+            portfolio.create_equity_curve_dataframe()
+            
+            if self.num_strats > 1:
+                print(f"Strategy {strategy_id}: {type(self.strategies[strategy_id]).__name__}")
+            print("Creating summary stats ... ")
+            stats = portfolio.output_summary_stats(
+                'equity.csv' if self.num_strats == 1 else f'equity_{strategy_id}.csv'
+            )
+            print("Creating equity curve ...")
+            print(self.data_handler.get_latest_bars(self.symbol_list[0], N=1))
+            print(portfolio.equity_curve.head(10))
+            print(portfolio.equity_curve.tail(10))
+            print(stats)
         print("Signals: %s" % self.signals) 
         print("Orders: %s" % self.orders) 
         print("Fills: %s" % self.fills)
+        if self.instrumentation is not None:
+            print(self.instrumentation.format_report())
         
-    def simulate_trading(self):
+    def simulate_trading(self, checkpoint_path=None, checkpoint_every=None):
         """
         Simulates the backtest and outputs portfolio performance.
+
+        Parameters:
+        checkpoint_path: file the run is saved to every checkpoint_every bars,
+        to be continued with Backtest.load_checkpoint() if it is interrupted
+        checkpoint_every: number of bars between two checkpoints
         """
-        self._run_backtest()
+        if (checkpoint_path is None) != (checkpoint_every is None):
+            raise ValueError("checkpoint_path and checkpoint_every go together")
+        if self.instrumentation is not None:
+            with self.instrumentation.run():
+                self._run_backtest(checkpoint_path=checkpoint_path, checkpoint_every=checkpoint_every)
+        else:
+            self._run_backtest(checkpoint_path=checkpoint_path, checkpoint_every=checkpoint_every)
         self._output_performance()
-        
-    
+
+
+class VectorizedBacktest(object):
+    """
+    Runs a VectorizedStrategy over the whole price panel with array operations
+    instead of sending every bar through the event queue.
+
+    The accounting follows the event-driven engine: a target set at bar t is
+    filled at bar t's adj_close, the holdings row of bar t shows the positions
+    held before that bar's fills, and the curve starts with a start_date row and
+    ends with a repeated last bar holding the final positions. Each change in
+    target position is one fill, charged with the same IB commission schedule
+    as FillEvent, or with fee_schedule, whose holding costs are charged on
+    every row like the Portfolio does.
+
+    It is meant for fast research sweeps; the event-driven Backtest stays the
+    reference for validation.
+    """
+
+    def __init__(self, csv_dir, symbol_list, initial_capital,
+                 start_date, end_date, data_handler, strategy, strategy_params=None,
+                 fee_schedule=None):
+        """
+        Initialises the vectorized backtest.
+
+        Parameters
+        ----------
+        csv_dir : The hard root to the CSV data directory.
+        symbol_list : list of symbols
+        initial_capital : starting cash
+        start_date, end_date : date range of the backtest
+        data_handler : DataHandler Class, must provide get_panel()
+        strategy : VectorizedStrategy Class
+        strategy_params : dict of keyword arguments for the strategy
+        fee_schedule : fees.FeeSchedule, the IB commission schedule if None
+        """
+        self.csv_dir = csv_dir
+        self.symbol_list = symbol_list
+        self.initial_capital = initial_capital
+        self.start_date = start_date
+        self.end_date = end_date
+
+        self.data_handler_cls = data_handler
+        self.strategy_cls = strategy
+        self.strategy_params = strategy_params or {}
+        self.fee_schedule = fee_schedule
+
+        self.data_handler = self.data_handler_cls(
+            None, self.csv_dir, self.symbol_list, self.start_date, self.end_date
+        )
+        self.strategy = self.strategy_cls(self.data_handler, **self.strategy_params)
+        self.equity_curve = None
+
+    def _run_backtest(self):
+        """
+        Computes positions, holdings, commissions and the equity curve.
+        """
+        prices = self.data_handler.get_panel('adj_close')
+        targets = self.strategy.generate_target_positions(prices)
+        targets = pd.DataFrame(targets, index=prices.index, columns=prices.columns)
+
+        price = prices.to_numpy(dtype='float64')
+        pos = targets.fillna(0).to_numpy(dtype='float64')
+
+        # Fills at bar t take the position from pos[t-1] to pos[t]
+        trades = np.diff(pos, axis=0, prepend=0.0)
+        cost = np.where(trades == 0, 0.0, trades * price).sum(axis=1)
+
+        # Rows: start_date, one per bar recorded before that bar's fills, and
+        # the repeated last bar recorded after them
+        n_sym = len(self.symbol_list)
+        held = np.vstack([np.zeros((2, n_sym)), pos])
+        mark = np.vstack([price[:1], price, price[-1:]])
+        holdings = np.where(held == 0, 0.0, held * mark)
+        self._trades, self._price, self._held, self._mark = trades, price, held, mark
+        self._cost, self._holdings = cost, holdings
+
+        # Fees booked by each row: the fills of the previous bar, plus the holding costs
+        row_commission = np.cumsum(self._row_fees(self.fee_schedule))
+        row_cash = np.concatenate([[self.initial_capital]*2, self.initial_capital - np.cumsum(cost)])
+        row_cash = row_cash - row_commission
+
+        index = pd.Index(
+            [self.start_date] + list(prices.index) + [prices.index[-1]], name='datetime'
+        )
+        curve = pd.DataFrame(holdings, index=index, columns=self.symbol_list)
+        curve['cash'] = row_cash
+        curve['commission'] = row_commission
+        curve['total'] = row_cash + holdings.sum(axis=1)
+        curve['returns'] = curve['total'].pct_change()
+        curve['equity_curve'] = (1+curve['returns']).cumprod()
+        self.positions = targets
+        self.equity_curve = curve
+
+    def _row_fees(self, fee_schedule):
+        """
+        Returns the fees booked by each row of the curve for a fee schedule.
+        """
+        holding_fees = np.zeros(len(self._held))
+        if fee_schedule is None:
+            trade_fees = calculate_ib_commission(self._trades).sum(axis=1)
+        else:
+            trade_fees = np.sum(fee_schedule.trade_cost(self._trades, self._price), axis=1)
+            if fee_schedule.has_holding_cost:
+                holding_fees = np.sum(fee_schedule.holding_cost(self._held, self._mark), axis=1)
+        return np.concatenate([[0.0, 0.0], trade_fees]) + holding_fees
+
+    def fee_sensitivity(self, fee_schedules):
+        """
+        Re-prices the trades of the last run under other fee schedules, without
+        running the strategy again: one array pass per schedule.
+
+        Parameters:
+        fee_schedules: dict of name -> FeeSchedule (None for the IB commission)
+
+        Returns a DataFrame with the total fees, final total and total return per schedule.
+        """
+        final_value = self.initial_capital - self._cost.sum() + self._holdings[-1].sum()
+        rows = []
+        for name, fee_schedule in fee_schedules.items():
+            fees = self._row_fees(fee_schedule).sum()
+            total = final_value - fees
+            rows.append((name, fees, total, total / self.initial_capital - 1.0))
+        return pd.DataFrame(rows, columns=['schedule', 'fees', 'total', 'total_return']).set_index('schedule')
+
+    def output_summary_stats(self):
+        """
+        Create a list of summary statsitics for the backtest,
+        in the same format as Portfolio.output_summary_stats().
+        """
+        total_return = self.equity_curve['equity_curve'].iloc[-1]
+        returns = self.equity_curve['returns']
+        pnl = self.equity_curve['equity_curve']
+
+        sharpe_ratio = create_sharpe_ratio(returns, periods=252)
+        drawdown, max_dd, dd_duration = create_drawdowns(pnl)
+        self.equity_curve['drawdown'] = drawdown
+
+        stats = [("Total Return", "%0.2f%%" % ((total_return - 1.0) * 100.0)),
+                 ("Sharpe Ratio", "%0.2f" % sharpe_ratio),
+                 ("Max Drawdown", "%0.2f%%" % (max_dd * 100.0)),
+                 ("Drawdown Duration", "%d" % dd_duration)]
+        return stats
+
+    def simulate_trading(self):
+        """
+        Simulates the backtest and returns the summary stats.
+        """
+        self._run_backtest()
+        stats = self.output_summary_stats()
+        print(self.equity_curve.tail(10))
+        print(stats)
+        return stats
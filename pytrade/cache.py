@@ -0,0 +1,286 @@
+import hashlib
+import io
+import json
+import os, os.path
+
+import numpy as np
+import pandas as pd
+
+
+def date_bounds(dates, start_date=None, end_date=None):
+    """
+    Returns the (lo, hi) positions of [start_date, end_date] in sorted int64
+    nanosecond dates, with the semantics of pandas label slicing: a date
+    string such as '2000-01-05' as end_date includes the whole day.
+    """
+    index = pd.DatetimeIndex(np.asarray(dates).view('datetime64[ns]'))
+    return index.slice_locs(start_date, end_date)
+
+
+class _SourceFileCache(object):
+    """
+    Base class of the on-disk caches derived from source files: one entry
+    directory per symbol, with a meta.json recording the source file's size,
+    mtime and sha1.
+
+    An entry is reused as long as the source file's size and mtime are unchanged.
+    If the mtime changed but the content hash did not (e.g. the file was copied
+    or touched), the entry is kept and its meta refreshed; otherwise it is rebuilt.
+    Entries written with another layout of the files are rebuilt too.
+    """
+    fields = ['open', 'high', 'low', 'close', 'volume', 'adj_close']
+    layout = None # 改变文件格式时修改, 旧的entry会被重建
+
+    def __init__(self, cache_dir):
+        """
+        Parameters:
+        cache_dir: directory holding the cache entries, created if missing.
+        """
+        self.cache_dir = cache_dir
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def _file_hash(path):
+        """
+        Returns the sha1 hex digest of a file.
+        """
+        h = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                h.update(chunk)
+        return h.hexdigest()
+
+    def _entry_dir(self, symbol):
+        return os.path.join(self.cache_dir, symbol)
+
+    def _read_meta(self, symbol):
+        try:
+            with open(os.path.join(self._entry_dir(symbol), 'meta.json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_meta(self, symbol, meta):
+        path = os.path.join(self._entry_dir(symbol), 'meta.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump(meta, f)
+        os.replace(path + '.tmp', path)
+
+    def _source_meta(self, csv_path):
+        """
+        Returns the meta.json items identifying the source file.
+        """
+        st = os.stat(csv_path)
+        return {
+            'layout': self.layout,
+            'source': os.path.abspath(csv_path),
+            'size': st.st_size,
+            'mtime_ns': st.st_mtime_ns,
+            'sha1': self._file_hash(csv_path),
+        }
+
+    def _valid_meta(self, symbol, csv_path):
+        """
+        Returns the meta of the cache entry of a symbol if it matches its CSV file,
+        else None. Refreshes the recorded mtime when only the mtime changed.
+        """
+        meta = self._read_meta(symbol)
+        if meta is None or meta.get('layout') != self.layout:
+            return None
+        st = os.stat(csv_path)
+        if meta['size'] != st.st_size:
+            return None
+        if meta['mtime_ns'] == st.st_mtime_ns:
+            return meta
+        if meta['sha1'] != self._file_hash(csv_path):
+            return None
+        meta['mtime_ns'] = st.st_mtime_ns
+        self._write_meta(symbol, meta)
+        return meta
+
+    def is_valid(self, symbol, csv_path):
+        """
+        Checks whether the cache entry of a symbol matches its CSV file,
+        refreshing the recorded mtime when only the mtime changed.
+        """
+        return self._valid_meta(symbol, csv_path) is not None
+
+
+class CSVBarCache(_SourceFileCache):
+    """
+    On-disk binary cache of OHLCV CSV files.
+
+    Each CSV file is parsed once and stored in <cache_dir>/<symbol>/ as two raw
+    arrays: datetime.i8 (int64 nanoseconds) and bars.f8, a (rows x fields) float64
+    array in C order and in the order of `fields`, next to a meta.json recording
+    the source file's size, mtime, sha1 and number of rows. Later loads
+    (load_arrays()) read the dates, then only the bytes of the rows of the
+    requested date range, straight into the returned array: no .npy header to
+    parse, no mapping to set up and no DataFrame.
+
+    Entries are invalidated as described in _SourceFileCache.
+    """
+    layout = 'bars.f8'
+
+    def build(self, symbol, csv_path):
+        """
+        Parses a CSV file, writes its cache entry and returns its meta.
+        """
+        df = pd.read_csv(
+            csv_path, header=0, index_col=0, parse_dates=True,
+            names=['datetime'] + self.fields
+        )
+        df.sort_index(inplace=True)
+
+        entry = self._entry_dir(symbol)
+        os.makedirs(entry, exist_ok=True)
+        df.index.values.astype('datetime64[ns]').view('int64').tofile(os.path.join(entry, 'datetime.i8'))
+        np.ascontiguousarray(df[self.fields].to_numpy(dtype='float64')).tofile(os.path.join(entry, 'bars.f8'))
+        # meta.json is written last, so a half written entry is never considered valid
+        meta = self._source_meta(csv_path)
+        meta['rows'] = len(df)
+        self._write_meta(symbol, meta)
+        return meta
+
+    def load_arrays(self, symbol, csv_path, start_date=None, end_date=None):
+        """
+        Returns (dates, bars) of a symbol restricted to [start_date, end_date]:
+        the int64 nanosecond dates and the (rows x fields) float64 bars.
+        Builds the cache entry first if it is missing or stale.
+        """
+        meta = self._valid_meta(symbol, csv_path)
+        if meta is None:
+            meta = self.build(symbol, csv_path)
+        entry = self._entry_dir(symbol)
+        dates = np.fromfile(os.path.join(entry, 'datetime.i8'), dtype='int64')
+        if len(dates) != meta['rows']:
+            raise OSError(f"Truncated cache entry {entry}")
+        lo, hi = (0, len(dates)) if start_date is None and end_date is None else date_bounds(dates, start_date, end_date)
+        width = len(self.fields)
+        bars = np.fromfile(
+            os.path.join(entry, 'bars.f8'), dtype='float64', count=max(hi - lo, 0) * width, offset=lo * width * 8
+        ).reshape(-1, width) # 只读取日期范围内的行
+        if len(bars) != max(hi - lo, 0):
+            raise OSError(f"Truncated cache entry {entry}")
+        return dates[lo:hi], bars
+
+    def load(self, symbol, csv_path, start_date=None, end_date=None):
+        """
+        Returns the OHLCV DataFrame of a symbol restricted to [start_date, end_date],
+        building the cache entry first if it is missing or stale.
+        """
+        dates, bars = self.load_arrays(symbol, csv_path, start_date, end_date)
+        index = pd.DatetimeIndex(dates.view('datetime64[ns]'), name='datetime')
+        return pd.DataFrame(bars, index=index, columns=self.fields)
+
+
+class CSVOffsetIndex(_SourceFileCache):
+    """
+    On-disk date -> byte offset index of OHLCV CSV files, so that a date range
+    is read by seeking to its first line and parsing only its bytes.
+
+    The entry of a symbol holds the dates of the rows (int64 nanoseconds) and
+    the byte offset where each row starts, built with one scan of the file and
+    invalidated like the other caches. Files that are not sorted by date, or
+    whose lines do not map one to one to rows (blank lines, quoted newlines...),
+    are flagged in meta.json and always read in full.
+    """
+
+    def build(self, symbol, csv_path):
+        """
+        Scans a CSV file and writes its offset index.
+        """
+        dates = pd.read_csv(
+            csv_path, header=0, usecols=[0], names=['datetime'], parse_dates=[0]
+        )['datetime'].values.astype('datetime64[ns]').view('int64')
+        data = np.fromfile(csv_path, dtype=np.uint8)
+        starts = np.flatnonzero(data == ord('\n')) + 1 # 每行的起始位置, 第一行是header
+        starts = starts[starts < len(data)]
+        indexable = len(starts) == len(dates) and bool(np.all(np.diff(dates) >= 0))
+
+        entry = self._entry_dir(symbol)
+        os.makedirs(entry, exist_ok=True)
+        if indexable:
+            np.save(os.path.join(entry, 'datetime.npy'), dates)
+            np.save(os.path.join(entry, 'offsets.npy'), starts.astype('int64'))
+        meta = self._source_meta(csv_path)
+        meta['rows'] = len(dates)
+        meta['indexable'] = indexable
+        self._write_meta(symbol, meta)
+
+    def byte_range(self, symbol, csv_path, start_date=None, end_date=None):
+        """
+        Returns the (begin, end) byte offsets of the rows in [start_date, end_date],
+        or None if the file has to be read in full. Builds the index if needed.
+        """
+        if not self.is_valid(symbol, csv_path):
+            self.build(symbol, csv_path)
+        if not self._read_meta(symbol)['indexable']:
+            return None
+        entry = self._entry_dir(symbol)
+        dates = np.load(os.path.join(entry, 'datetime.npy'), mmap_mode='r')
+        offsets = np.load(os.path.join(entry, 'offsets.npy'), mmap_mode='r')
+        lo, hi = date_bounds(dates, start_date, end_date)
+        if lo >= hi:
+            return (0, 0)
+        end = int(offsets[hi]) if hi < len(offsets) else os.path.getsize(csv_path)
+        return (int(offsets[lo]), end)
+
+    def load(self, symbol, csv_path, start_date=None, end_date=None):
+        """
+        Returns the OHLCV DataFrame of a symbol restricted to [start_date, end_date],
+        reading only the bytes of that range when the file is indexable.
+        """
+        names = ['datetime'] + self.fields
+        span = self.byte_range(symbol, csv_path, start_date, end_date)
+        if span is None:
+            df = pd.read_csv(csv_path, header=0, index_col=0, parse_dates=True, names=names)
+            return df.sort_index()[start_date:end_date]
+        begin, end = span
+        with open(csv_path, 'rb') as f:
+            f.seek(begin)
+            chunk = f.read(end - begin)
+        if not chunk:
+            return pd.DataFrame(
+                dict((c, np.empty(0)) for c in self.fields),
+                index=pd.DatetimeIndex([], name='datetime')
+            )
+        return pd.read_csv(io.BytesIO(chunk), header=None, index_col=0, parse_dates=True, names=names)
+
+
+def build_panel_from_csv(csv_dir, symbol_list, panel_dir, fields=None):
+    """
+    Writes the CSV files of symbol_list into one memory-mappable panel in panel_dir:
+
+    - bars.f8: raw float64 array of shape (dates, symbols, fields), C order,
+      so all the bars of one date are contiguous on disk
+    - dates.npy: int64 nanosecond timestamps of the union calendar
+    - meta.json: shape, symbols and fields
+
+    Each symbol is forward padded onto the union calendar and gets a 'returns'
+    field, like HistoricCSVDataHandler. Only one symbol is held in memory at a time.
+    """
+    if fields is None:
+        fields = ['open', 'high', 'low', 'close', 'volume', 'adj_close', 'returns']
+    names = ['datetime'] + CSVBarCache.fields
+    paths = [os.path.join(csv_dir, f'{s}.csv') for s in symbol_list]
+
+    # First pass: the union of all dates
+    dates = pd.DatetimeIndex([])
+    for path in paths:
+        dates = dates.union(pd.read_csv(path, header=0, usecols=[0], names=names[:1], parse_dates=[0])['datetime'])
+
+    os.makedirs(panel_dir, exist_ok=True)
+    shape = (len(dates), len(symbol_list), len(fields))
+    panel = np.memmap(os.path.join(panel_dir, 'bars.f8'), dtype='float64', mode='w+', shape=shape)
+    for i, path in enumerate(paths):
+        df = pd.read_csv(path, header=0, index_col=0, parse_dates=True, names=names)
+        df = df.sort_index().reindex(index=dates, method='pad')
+        df['returns'] = df['adj_close'].pct_change()
+        panel[:, i, :] = df[fields].to_numpy(dtype='float64')
+    panel.flush()
+    del panel
+
+    np.save(os.path.join(panel_dir, 'dates.npy'), dates.values.astype('datetime64[ns]').view('int64'))
+    with open(os.path.join(panel_dir, 'meta.json'), 'w') as f:
+        json.dump({'shape': shape, 'symbols': list(symbol_list), 'fields': fields}, f)
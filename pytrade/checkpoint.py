@@ -0,0 +1,87 @@
+import gzip
+import os
+import pickle
+
+# 回测快照: 一个gzip压缩的pickle文件, 先写一个小的header(dict), 再写整个对象.
+# 行情数组不写入快照, 由DataHandler在加载时从原数据重新读取(见HistoricCSVDataHandler.__getstate__).
+
+CHECKPOINT_VERSION = 1
+
+
+class _Unpickler(pickle.Unpickler):
+    """
+    An Unpickler that loads some classes as replacements, given by
+    (module, qualified name) -> class.
+    """
+    def __init__(self, file, classes):
+        super(_Unpickler, self).__init__(file)
+        self.classes = classes
+
+    def find_class(self, module, name):
+        if (module, name) in self.classes:
+            return self.classes[(module, name)]
+        return super(_Unpickler, self).find_class(module, name)
+
+
+def class_name(cls):
+    """
+    Returns the (module, qualified name) pickle records for a class.
+    """
+    return (cls.__module__, cls.__qualname__)
+
+
+def save_checkpoint(obj, path, header=None, compresslevel=1):
+    """
+    Writes obj to path as a compressed pickle, preceded by a small header dict
+    that read_header() returns without loading obj.
+
+    The file is written next to path and renamed over it, so a run killed
+    while saving leaves the previous checkpoint intact.
+
+    Parameters:
+    obj: the object to save, e.g. a Backtest
+    path: file to write
+    header: dict of picklable metadata stored in front of obj
+    compresslevel: gzip level, 1 (fast) to 9 (small)
+    """
+    header = dict(header or {}, version=CHECKPOINT_VERSION)
+    tmp = f'{path}.tmp'
+    try:
+        with gzip.open(tmp, 'wb', compresslevel=compresslevel) as f:
+            pickle.dump(header, f, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+    except BaseException:
+        os.remove(tmp)
+        raise
+    os.replace(tmp, path)
+
+
+def _open(source):
+    return gzip.open(source, 'rb') if isinstance(source, (str, os.PathLike)) else gzip.GzipFile(fileobj=source, mode='rb')
+
+
+def read_header(source):
+    """
+    Returns the header dict of a checkpoint (a path or a binary file object).
+    """
+    with _open(source) as f:
+        return pickle.load(f)
+
+
+def load_checkpoint(source, classes=None):
+    """
+    Loads a checkpoint written by save_checkpoint().
+
+    Parameters:
+    source: path or binary file object
+    classes: optional dict of (module, qualified name) -> class, loading the
+    objects saved as one class as instances of another (e.g. another data handler)
+
+    Returns (header, obj).
+    """
+    with _open(source) as f:
+        header = pickle.load(f)
+        if header.get('version') != CHECKPOINT_VERSION:
+            raise ValueError(f"Unsupported checkpoint version {header.get('version')}, expected {CHECKPOINT_VERSION}")
+        obj = _Unpickler(f, classes or {}).load()
+    return header, obj
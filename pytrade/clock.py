@@ -0,0 +1,60 @@
+from abc import ABCMeta, abstractmethod
+import datetime
+import time
+
+
+class Clock(object):
+    """
+    Clock is an abstract base class for the source of "now" used by the components,
+    and for the pacing between two bars of the engine loop.
+    """
+    __metaclass__ = ABCMeta
+
+    def __init__(self, bars, heartbeat=0.0):
+        """
+        Parameters:
+        bars: The DataHandler object
+        heartbeat: seconds to wait between two bars, only used by real time clocks
+        """
+        self.bars = bars
+        self.heartbeat = heartbeat
+
+    @abstractmethod
+    def now(self):
+        """
+        Returns the current time.
+        """
+        raise NotImplementedError("Should implement now()")
+
+    @abstractmethod
+    def wait(self):
+        """
+        Called by the engine after each bar.
+        """
+        raise NotImplementedError("Should implement wait()")
+
+
+class SimulatedClock(Clock):
+    """
+    Backtest clock: the current time is the datetime of the latest bar, so
+    fills and signals are stamped deterministically with bar time. It never
+    sleeps and makes no system call.
+    """
+    def now(self):
+        return self.bars.get_latest_bar_datetime(self.bars.symbol_list[0])
+
+    def wait(self):
+        pass
+
+
+class WallClock(Clock):
+    """
+    Live/paper trading clock: the current time is the UTC wall time, and the
+    engine sleeps heartbeat seconds between two bars.
+    """
+    def now(self):
+        return datetime.datetime.utcnow()
+
+    def wait(self):
+        if self.heartbeat > 0:
+            time.sleep(self.heartbeat)
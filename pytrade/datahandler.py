@@ -2,11 +2,21 @@
 
 from abc import ABCMeta, abstractmethod
 import datetime
+import heapq
+import io
+import json
+import mmap
 import os, os.path
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+import threading
 
 import numpy as np
 import pandas as pd
 
+from .cache import CSVBarCache, CSVOffsetIndex, date_bounds
 from .event import MarketEvent
 
 # DataHandler是一个abc, 从而不能够被实例化，但他的子类可以被实例化。 使用__metaclass__ 让python知道这是个abc
@@ -58,7 +68,71 @@ class DataHandler(object):
         Returns the last N bar values from the latest_symbol list or N-k if less available,
         """
         raise NotImplementedError("Should implement get_latest_bars_values()")
+
+    def get_latest_bars_block(self, symbol, val_types, N=1):
+        """
+        Returns the last N bars of several fields as an (N, fields) array,
+        or (N-k, fields) if less available.
+
+        Subclasses with a columnar store should override this to return a view.
+        """
+        return np.column_stack(
+            [self.get_latest_bars_values(symbol, v, N) for v in val_types]
+        )
+
+    def get_latest_bars_matrix(self, val_type, N=1):
+        """
+        Returns the last N values of one field for all the symbols as an
+        (N, symbols) array in symbol_list order, or (N-k, symbols) if less available.
+
+        Subclasses with a columnar store should override this to return a view.
+        """
+        return np.column_stack(
+            [self.get_latest_bars_values(s, val_type, N) for s in self.symbol_list]
+        )
     
+    def register_indicator(self, key, name, indicator, field='adj_close'):
+        """
+        Registers a streaming indicator (see pytrade.indicators) fed with `field`
+        on every new bar, and warms it up with the bars already seen.
+
+        Parameters:
+        key: a symbol, or a tuple of symbols for indicators taking several inputs
+        (e.g. ('AREX', 'WLL') for RollingBeta, fed with update(y, x))
+        name: name of the indicator for this key, e.g. 'sma50'
+        indicator: the Indicator instance
+        field: bar field fed to the indicator
+
+        Returns the registered indicator. If the same key/name is registered
+        again, the existing indicator is kept and returned, so several strategies
+        can share it.
+        """
+        if (key, name) in self.indicators:
+            return self.indicators[(key, name)][0]
+        symbols = key if isinstance(key, tuple) else (key,)
+        self.indicators[(key, name)] = (indicator, symbols, field)
+        history = [self.get_latest_bars_values(s, field, N=self.bar_index) for s in symbols]
+        for values in zip(*history):
+            if not np.isnan(values).any():
+                indicator.update(*values)
+        return indicator
+
+    def get_indicator(self, key, name):
+        """
+        Returns the current value of a registered indicator.
+        """
+        return self.indicators[(key, name)][0].value
+
+    def _update_indicators(self):
+        """
+        Feeds the latest bar to all registered indicators. Bars with a
+        missing (NaN) input are skipped.
+        """
+        for indicator, symbols, field in self.indicators.values():
+            values = [self.get_latest_bar_value(s, field) for s in symbols]
+            if not any(v != v for v in values):
+                indicator.update(*values)
+
     @abstractmethod
     def update_bars(self):
         """
@@ -73,7 +147,30 @@ class DataHandler(object):
 class HistoricCSVDataHandler(DataHandler):
     """
     读csv文件
+
+    The bars of every symbol are held in a columnar store: one preallocated
+    (bars x fields) float array per symbol, aligned on a common datetime index,
+    plus a single cursor ``bar_index`` that advances on each call to update_bars().
+    Everything before the cursor is the "latest" data seen by the rest of the system.
+
+    When a date range is given, each CSV file is read through a CSVOffsetIndex
+    (cached in <csv_dir>/.cache/offsets unless offset_index_dir is set), so only
+    the bytes of the range are parsed. The common index is the union of all the
+    symbols' dates; each symbol is forward padded onto it.
+
+    The arrays are read-only and stored field-contiguous (Fortran order), so
+    get_latest_bars_values() and get_latest_bars_block() return zero-copy views:
+    a 1000-bar lookback costs the same as a 1-bar one. Copy the result if it
+    must outlive or be modified independently of the store.
+
+    Pickling (see pytrade.checkpoint) keeps the cursor and the indicators but
+    not the bars, which are read again from the source when unpickled.
     """
+    bar_fields = ['open', 'high', 'low', 'close', 'volume', 'adj_close', 'returns']
+    offset_index_dir = None
+    # Attributes rebuilt by _open_convert_csv_files() instead of being pickled
+    _reloaded = ('symbol_data', 'field_matrices', 'bar_datetimes')
+
     def __init__(self, events, csv_dir, symbol_list, start_date, end_date):
         """
         events: 事件队列
@@ -85,132 +182,609 @@ class HistoricCSVDataHandler(DataHandler):
         self.end_date = end_date
         
         
-        self.symbol_data = {} # 存放所有
-        self.latest_symbol_data = {}
+        self.symbol_data = {} # 存放所有, symbol -> (bars x fields) array
+        self.field_index = dict((f, j) for j, f in enumerate(self.bar_fields))
+        self.bar_datetimes = None
+        self.bar_index = 0 # 游标, 指向下一个要推送的bar
         self.continue_backtest = True
+        self.indicators = {} # (key, name) -> (indicator, symbols, field)
+        self.field_matrices = {} # val_type -> (dates x symbols) array
         
         self._open_convert_csv_files()
-        
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if self._reloaded:
+            for name in self._reloaded:
+                state.pop(name, None)
+            state['_num_bars'] = len(self.bar_datetimes)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self._reloaded:
+            self.symbol_data = {}
+            self.field_matrices = {}
+            self._open_convert_csv_files()
+            if len(self.bar_datetimes) != self._num_bars:
+                raise ValueError(
+                    f"The data reloaded from {self.csv_dir} has {len(self.bar_datetimes)} bars, "
+                    f"the checkpoint was taken on {self._num_bars}"
+                )
         
     def _open_convert_csv_files(self):
         """
-        加载csv文件, 并转化为DataFrames 格式
+        加载csv文件, 并转化为columnar arrays
         """
-        # 读入历史所有数据，并将第一列作为DatetimeIndex
-        # 
-        comb_index = None
+        arrays = dict((s, self._read_symbol_arrays(s)) for s in self.symbol_list)
+        # Combine the index to pad forward values, 换句话说, 我们后边需要取合并数据集，所以index选择union
+        # 通常所有symbol的日期都相同, 只合并与第一个symbol不同的日期
+        first = arrays[self.symbol_list[0]][0]
+        others = [d for d, _ in arrays.values() if not np.array_equal(d, first)]
+        comb_dates = np.unique(np.concatenate([first] + others))
+        comb_index = pd.DatetimeIndex(comb_dates.view('datetime64[ns]'), name='datetime')
+        j_adj, j_ret = self.field_index['adj_close'], self.field_index['returns']
         
         for s in self.symbol_list:
-            self.symbol_data[s] = pd.read_csv(
-                os.path.join(self.csv_dir, f'{s}.csv'),
-                header=0, index_col=0, parse_dates=True,
-                names = [
-                    'datetime', 'open', 'high', 'low', 'close', 'volume', 'adj_close',
-                ]
-            )
-            self.symbol_data[s].sort_index(inplace=True)
-            self.symbol_data[s] = self.symbol_data[s][self.start_date:self.end_date]
-            # Combine the index to pad forward values, 换句话说, 我们后边需要取合并数据集，所以index选择untion
-            if comb_index is None:
-                comb_index = self.symbol_data[s].index
+            dates, bars = arrays[s]
+            # Fortran order keeps each field contiguous in memory
+            data = np.empty((len(comb_index), len(self.bar_fields)), order='F')
+            if np.array_equal(dates, comb_dates):
+                data[:, :j_ret] = bars # 日期与合并后的index相同, 直接复制
             else:
-                comb_index.union(self.symbol_data[s].index)
-            # 把最新的数据设置为空
-            self.latest_symbol_data[s] = []
+                # 每个日期取该symbol在它之前(含)的最后一个bar, 等价于reindex(method='pad')
+                rows = np.searchsorted(dates.view('datetime64[ns]'), comb_index.values, side='right') - 1
+                data[:, :j_ret] = bars[rows] if len(dates) else np.nan
+                data[rows < 0, :j_ret] = np.nan
+            data[:1, j_ret] = np.nan
+            data[1:, j_ret] = data[1:, j_adj] / data[:-1, j_adj] - 1.0
+            data.flags.writeable = False # 只读, 保证返回的view不会被策略修改
+            self.symbol_data[s] = data
+        self.bar_datetimes = comb_index
             
-        for s in self.symbol_list:
-            # 更改index, 事实上应该是可以直接用trade_dates
-            self.symbol_data[s] = self.symbol_data[s].reindex(
-                index = comb_index, method='pad'
-            )
-            self.symbol_data[s]["returns"] = self.symbol_data[s]["adj_close" ].pct_change().dropna() # 这个dropna感觉没什么用, 返回的结果和你想象的一样
-            # 然后按照rows, 把一个股票的行情数据转化为一个generator, 这个generator每次生成一个tuple, 这个tuple的第一个元素是时间
-            self.symbol_data[s] = self.symbol_data[s].iterrows()
-            
-    def _get_new_bar(self, symbol):
+    def _read_symbol_arrays(self, symbol):
         """
-        Return the lastest bar from the date feed.
+        Returns the (dates, bars) of one symbol in [start_date, end_date]: sorted
+        int64 nanosecond dates and the (rows x fields) float array of the price
+        fields (bar_fields without 'returns'). Views are fine, the rows are copied
+        into the store. Reads _read_symbol_frame() unless overridden.
         """
-        for b in self.symbol_data[symbol]:
-            yield b 
-        # 这和直接next(self.symbol_data[symbol])效果一样
-    def get_latest_bar(self, symbol):
+        df = self._read_symbol_frame(symbol)
+        return (df.index.values.astype('datetime64[ns]').view('int64'),
+                df[self.bar_fields[:-1]].to_numpy(dtype='float64'))
+
+    def _read_symbol_frame(self, symbol):
+        """
+        Reads the OHLCV DataFrame of one symbol, sorted by date and sliced
+        to [start_date, end_date].
+        """
+        if self.start_date is not None or self.end_date is not None:
+            try:
+                index = CSVOffsetIndex(self.offset_index_dir or os.path.join(self.csv_dir, '.cache', 'offsets'))
+                return index.load(symbol, os.path.join(self.csv_dir, f'{symbol}.csv'), self.start_date, self.end_date)
+            except OSError as e:
+                print(f"Offset index unavailable for {symbol} ({e}), reading the whole file")
+        df = pd.read_csv(
+            os.path.join(self.csv_dir, f'{symbol}.csv'),
+            header=0, index_col=0, parse_dates=True,
+            names = [
+                'datetime', 'open', 'high', 'low', 'close', 'volume', 'adj_close',
+            ]
+        )
+        df.sort_index(inplace=True)
+        return df[self.start_date:self.end_date]
+
+    def _get_symbol_array(self, symbol):
         """
-        Returns the last bar from the lastes_symbol list
+        Returns the (bars x fields) array of a symbol.
         """
         try:
-            bars_list = self.latest_symbol_data[symbol]
+            return self.symbol_data[symbol]
         except KeyError:
             print("That symbol is not available in the historical data set.")
             raise
-        else:
-            return bars_list[-1]
+
+    def _get_field_index(self, val_type):
+        """
+        Returns the column of a field in the bar arrays.
+        """
+        try:
+            return self.field_index[val_type]
+        except KeyError:
+            raise KeyError(f"Unknown bar field '{val_type}', expected one of {self.bar_fields}")
+
+    def _make_bar(self, symbol, i):
+        """
+        Builds a (datetime, pd.Series) bar from row i of a symbol.
+        """
+        return (self.bar_datetimes[i],
+                pd.Series(self.symbol_data[symbol][i], index=self.bar_fields, name=self.bar_datetimes[i]))
+
+    def get_latest_bar(self, symbol):
+        """
+        Returns the last bar as a (datetime, pd.Series) tuple.
+        """
+        self._get_symbol_array(symbol)
+        if self.bar_index == 0:
+            raise IndexError("No bars have been updated yet.")
+        return self._make_bar(symbol, self.bar_index - 1)
         
     def get_latest_bars(self, symbol, N=1):
         """
-        Returns the last N bars from the latest_symbol list,
+        Returns the last N bars as (datetime, pd.Series) tuples,
         or N-k if less available.
         """
-        try:
-            bars_list = self.latest_symbol_data[symbol]
-        except KeyError:
-            print("That symbol is not available in the historical data set.")
-            raise
-        else:
-            return bars_list[-N:]
+        self._get_symbol_array(symbol)
+        return [self._make_bar(symbol, i) for i in range(max(self.bar_index - N, 0), self.bar_index)]
             
     def get_latest_bar_datetime(self, symbol):
         """
         Returns a Python datime object for the last bar
         """
-        try:
-            bars_list = self.latest_symbol_data[symbol]
-        except KeyError:
-            print("That symbol is not available in the historical data set.")
-            raise
-        else:
-            return bars_list[-1][0]
+        self._get_symbol_array(symbol)
+        if self.bar_index == 0:
+            raise IndexError("No bars have been updated yet.")
+        return self.bar_datetimes[self.bar_index - 1]
         
     def get_latest_bar_value(self, symbol, val_type):
         """
         Returns one of the Open, High, Low, Close, Volumn or OI
-        values from the Pandas Bar series object.
+        values from the last bar.
         """
-        try:
-            bars_list = self.latest_symbol_data[symbol]
-        except KeyError:
-            print("That symbol is not available in the historical data set.")
-            raise
-        else:
-            return getattr(bars_list[-1][1], val_type) # 因为我们知道了bars_list是一个tuple, 第一个位置是一个series
+        bars = self._get_symbol_array(symbol)
+        if self.bar_index == 0:
+            raise IndexError("No bars have been updated yet.")
+        return bars[self.bar_index - 1, self._get_field_index(val_type)]
         
     def get_latest_bars_values(self, symbol, val_type, N=1) -> np.array:
         """
-        Returns the last N bar values from the 
-        latest_symbol list, or N-k if less available
+        Returns the last N bar values, or N-k if less available,
+        as a read-only view into the symbol's bar array.
+        """
+        bars = self._get_symbol_array(symbol)
+        return bars[max(self.bar_index - N, 0):self.bar_index, self._get_field_index(val_type)]
+
+    def get_latest_bars_block(self, symbol, val_types=None, N=1):
+        """
+        Returns the last N bars of several fields as an (N, fields) array,
+        or (N-k, fields) if less available.
+
+        Parameters:
+        symbol: 股票代码
+        val_types: list of fields, in the order they should appear as columns.
+        None means all of self.bar_fields.
+        N: lookback
+
+        When val_types is None or a run of adjacent fields in self.bar_fields
+        order (e.g. ['open', 'high', 'low', 'close']), the result is a read-only
+        view; any other selection has to be gathered and is returned as a copy.
+        """
+        bars = self._get_symbol_array(symbol)
+        rows = slice(max(self.bar_index - N, 0), self.bar_index)
+        if val_types is None:
+            return bars[rows, :]
+        cols = [self._get_field_index(v) for v in val_types]
+        if cols == list(range(cols[0], cols[0] + len(cols))):
+            return bars[rows, cols[0]:cols[0] + len(cols)]
+        return bars[rows][:, cols]
+    
+    def _get_field_matrix(self, val_type):
+        """
+        Returns the full (dates x symbols) read-only array of one field, built
+        from the per-symbol arrays the first time it is asked for.
         """
         try:
-            bars_list = self.get_latest_bars(symbol, N)
+            return self.field_matrices[val_type]
         except KeyError:
-            print("That symbol is not available in the historical data set.")
-            raise
+            j = self._get_field_index(val_type)
+            matrix = np.column_stack([self.symbol_data[s][:, j] for s in self.symbol_list])
+            matrix.flags.writeable = False
+            self.field_matrices[val_type] = matrix
+            return matrix
+
+    def get_latest_bars_matrix(self, val_type, N=1):
+        """
+        Returns the last N values of one field for all the symbols as an
+        (N, symbols) read-only view, or (N-k, symbols) if less available.
+        The cross-sectional copy of the field is made once, on the first call.
+        """
+        return self._get_field_matrix(val_type)[max(self.bar_index - N, 0):self.bar_index]
+
+    def get_panel(self, val_type):
+        """
+        Returns the full history of one field as a (dates x symbols) DataFrame,
+        regardless of the cursor. Only meant for vectorized research, where
+        the strategy itself is responsible for not looking ahead.
+        """
+        return pd.DataFrame(
+            self._get_field_matrix(val_type), index=self.bar_datetimes, columns=self.symbol_list
+        )
+
+    def update_bars(self):
+        """
+        Advances the cursor by one bar for all symbols in the
+        self.symbol_list and puts a MarketEvent on the queue.
+        """
+        # 所有symbol共用一个index, 所以游标前进一格即可
+        if self.bar_index < len(self.bar_datetimes):
+            self.bar_index += 1
+            if self.indicators:
+                self._update_indicators()
         else:
-            return np.array([getattr(b[1], val_type) for b in bars_list])
-    
+            self.continue_backtest = False
+        self.events.put(MarketEvent())
+
+class CachedCSVDataHandler(HistoricCSVDataHandler):
+    """
+    A HistoricCSVDataHandler that reads the CSV files through a CSVBarCache,
+    so each file is only parsed the first time it is used (or after it changes).
+    The cache lives in <csv_dir>/.cache unless cache_dir is set on the class.
+    The memory-mapped rows of the date range are copied straight into the store,
+    without building DataFrames.
+    """
+    cache_dir = None
+
+    def __init__(self, events, csv_dir, symbol_list, start_date, end_date):
+        self.cache = CSVBarCache(self.cache_dir or os.path.join(csv_dir, '.cache'))
+        super(CachedCSVDataHandler, self).__init__(events, csv_dir, symbol_list, start_date, end_date)
+
+    def _read_symbol_arrays(self, symbol):
+        """
+        Maps the date range of one symbol from the cache.
+        """
+        return self.cache.load_arrays(
+            symbol, os.path.join(self.csv_dir, f'{symbol}.csv'), self.start_date, self.end_date
+        )
+
+    def _read_symbol_frame(self, symbol):
+        """
+        Loads the date range of one symbol from the cache.
+        """
+        return self.cache.load(
+            symbol, os.path.join(self.csv_dir, f'{symbol}.csv'), self.start_date, self.end_date
+        )
+
+
+class MemmapPanelDataHandler(HistoricCSVDataHandler):
+    """
+    A data handler backed by one memory-mapped panel file (dates x symbols x fields),
+    as written by cache.build_panel_from_csv(); csv_dir is the panel directory.
+
+    Nothing is read up front: each symbol's bars are a strided view of the mapping,
+    so the accessors of HistoricCSVDataHandler work unchanged and only the pages
+    the cursor touches are read from disk. Every release_interval bars, the pages
+    older than max_lookback bars are dropped again, which keeps the resident
+    memory bounded however long the panel is. Lookbacks longer than max_lookback
+    still work; the older pages are just read back from disk.
+    """
+    max_lookback = 1000
+    release_interval = 4096
+    _reloaded = HistoricCSVDataHandler._reloaded + ('panel',)
+
+    def _open_convert_csv_files(self):
+        """
+        Maps the panel and selects the symbols and date range of the backtest.
+        """
+        with open(os.path.join(self.csv_dir, 'meta.json')) as f:
+            meta = json.load(f)
+        if meta['fields'] != self.bar_fields:
+            raise ValueError(f"Panel fields {meta['fields']} do not match {self.bar_fields}")
+        self.panel = np.memmap(
+            os.path.join(self.csv_dir, 'bars.f8'), dtype='float64', mode='r', shape=tuple(meta['shape'])
+        )
+        dates = np.load(os.path.join(self.csv_dir, 'dates.npy'), mmap_mode='r')
+        lo, hi = date_bounds(dates, self.start_date, self.end_date)
+        self.panel_offset = int(lo)
+        self.bar_datetimes = pd.DatetimeIndex(np.array(dates[lo:hi]).view('datetime64[ns]'))
+
+        panel_ids = dict((s, i) for i, s in enumerate(meta['symbols']))
+        for s in self.symbol_list:
+            if s not in panel_ids:
+                raise KeyError(f"Symbol {s} is not in the panel {self.csv_dir}")
+            self.symbol_data[s] = self.panel[lo:hi, panel_ids[s], :]
+        self._released_rows = 0
+        if list(self.symbol_list) == meta['symbols']:
+            # The panel is already cross-sectional: no copy needed
+            for j, f in enumerate(self.bar_fields):
+                self.field_matrices[f] = self.panel[lo:hi, :, j]
+
+    def _release_pages(self):
+        """
+        Drops the mapped pages of the rows older than max_lookback bars.
+        """
+        rows = self.panel_offset + self.bar_index - self.max_lookback
+        if rows <= self._released_rows or not hasattr(mmap, 'MADV_DONTNEED'):
+            return
+        row_bytes = self.panel.shape[1] * self.panel.shape[2] * self.panel.itemsize
+        length = rows * row_bytes // mmap.PAGESIZE * mmap.PAGESIZE
+        if length > 0:
+            self.panel._mmap.madvise(mmap.MADV_DONTNEED, 0, length)
+        self._released_rows = rows
+
     def update_bars(self):
+        super(MemmapPanelDataHandler, self).update_bars()
+        if self.bar_index % self.release_interval == 0:
+            self._release_pages()
+
+
+class BufferedDataHandler(HistoricCSVDataHandler):
+    """
+    Base class of the data handlers whose bars arrive one at a time (live feeds,
+    streamed files) instead of being loaded up front.
+
+    Bars are appended to the same kind of columnar (bars x fields) arrays as
+    HistoricCSVDataHandler, so all its accessors work unchanged. Only the latest
+    max_bars bars are kept: when a buffer is full, its newest lookback bars are
+    moved to the front. Views returned by the accessors are therefore only valid
+    until the next bar, and lookbacks longer than `lookback` bars are not available.
+    The buffers are part of the state and pickled as they are.
+    """
+    _reloaded = ()
+
+    def __init__(self, events, symbol_list, max_bars=10000, lookback=1000):
+        """
+        Parameters:
+        events: The Event Queue object
+        symbol_list: list of symbols
+        max_bars: capacity of the buffers
+        lookback: number of bars kept when a buffer is compacted
+        """
+        self.events = events
+        self.symbol_list = symbol_list
+        self.max_bars = max_bars
+        self.lookback = lookback
+        self.field_index = dict((f, j) for j, f in enumerate(self.bar_fields))
+        self.symbol_data = dict(
+            (s, np.full((max_bars, len(self.bar_fields)), np.nan, order='F')) for s in symbol_list
+        )
+        self.bar_datetimes = [None] * max_bars
+        self.bar_index = 0
+        self.continue_backtest = True
+        self.indicators = {}
+
+    def _compact(self):
         """
-        Pushes the latest bar to the latest_symbol_data structure
-        for all symbols in the self.symbol_list
+        Moves the newest lookback bars to the front of the buffers.
         """
+        keep = min(self.lookback, self.bar_index)
+        start = self.bar_index - keep
         for s in self.symbol_list:
-            try:
-                bar = next(self._get_new_bar(s)) # 取一天的数据, 然后self.symbol_data就少一行数据, 而且这和直接next(self.symbol_data[symbol])效果一样
-            except StopIteration:
-                self.continue_backtest = False
-            else:
-                if bar is not None:
-                    self.latest_symbol_data[s].append(bar)
+            self.symbol_data[s][:keep] = self.symbol_data[s][start:self.bar_index]
+        self.bar_datetimes[:keep] = self.bar_datetimes[start:self.bar_index]
+        self.bar_index = keep
+
+    def _next_row(self):
+        """
+        Returns the buffer row of the next bar, compacting the buffers if they are full.
+        """
+        if self.bar_index == self.max_bars:
+            self._compact()
+        return self.bar_index
+
+    def _commit_row(self, bar_datetime):
+        """
+        Publishes the row written at _next_row(): advances the cursor, updates
+        the indicators and puts a MarketEvent on the queue.
+        """
+        self.bar_datetimes[self.bar_index] = bar_datetime
+        self.bar_index += 1
+        if self.indicators:
+            self._update_indicators()
         self.events.put(MarketEvent())
 
+    def get_latest_bars_matrix(self, val_type, N=1):
+        # The buffers change with every bar, so no cached cross-sectional copy
+        return DataHandler.get_latest_bars_matrix(self, val_type, N)
+
+
+class StreamingCSVDataHandler(BufferedDataHandler):
+    """
+    Streams CSV files too large for memory, e.g. years of minute bars.
+
+    A small pool of reader_threads background threads cycles over the symbols:
+    each pass reads the next chunk of chunk_size rows of every symbol whose
+    bounded queue has room for it, so up to `prefetch` chunks per symbol are
+    parsed while the current one is consumed. A file is only open while one of
+    its chunks is read, and the position of the next one is kept as a byte
+    offset, so the number of threads and open files does not grow with the
+    number of symbols.
+
+    update_bars() merges the symbols by timestamp with a heap: each bar is the
+    next timestamp of any symbol, and the symbols without a row at that
+    timestamp are padded with their previous bar, as on the union calendar of
+    HistoricCSVDataHandler.
+
+    Memory is bounded by the chunks in flight and the max_bars buffers, whatever
+    the length of the files. The files must be sorted by date.
+    """
+    chunk_size = 50000
+    prefetch = 2
+    reader_threads = 1
+    max_bars = 20000
+    lookback = 5000
+    columns = ['datetime', 'open', 'high', 'low', 'close', 'volume', 'adj_close']
+
+    def __init__(self, events, csv_dir, symbol_list, start_date, end_date):
+        super(StreamingCSVDataHandler, self).__init__(events, symbol_list, self.max_bars, self.lookback)
+        self.csv_dir = csv_dir
+        self.start_date = start_date
+        self.end_date = end_date
+        self._stop = threading.Event()
+        self._queues = dict((s, queue.Queue(maxsize=self.prefetch)) for s in self.symbol_list)
+        # 每个reader线程负责symbol_list[k::n], 消费者取走一个chunk后唤醒对应的线程
+        n = max(1, min(self.reader_threads, len(self.symbol_list)))
+        self._wakeups = [threading.Event() for _ in range(n)]
+        self._reader_of = dict((s, self._wakeups[k % n]) for k, s in enumerate(self.symbol_list))
+        self._threads = []
+        for k in range(n):
+            thread = threading.Thread(target=self._read_chunks, args=(self.symbol_list[k::n], self._wakeups[k]), daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+        # 每个symbol: 当前chunk的(dates, values)以及chunk内的游标
+        self._chunks = dict((s, None) for s in self.symbol_list)
+        self._positions = dict((s, 0) for s in self.symbol_list)
+        self._last_rows = dict((s, None) for s in self.symbol_list)
+        self._heap = []
+        try:
+            for i, s in enumerate(self.symbol_list):
+                if self._next_chunk(s):
+                    heapq.heappush(self._heap, (self._chunks[s][0][0], i))
+        except Exception:
+            self.close()
+            raise
+
+    def __getstate__(self):
+        # 读取线程和chunk队列无法保存
+        raise TypeError(f"{type(self).__name__} cannot be pickled or checkpointed, use HistoricCSVDataHandler")
+
+    def _path(self, symbol):
+        return os.path.join(self.csv_dir, f'{symbol}.csv')
+
+    def _read_chunk(self, symbol, position):
+        """
+        Reads the chunk of a symbol's file starting at position (None for the
+        first one), opening and closing the file.
+
+        Returns ((int64 nanosecond dates, (rows x 6) float64 values), next position),
+        or (None, None) at the end of the file.
+        """
+        with open(self._path(symbol), 'rb') as f:
+            if position is None:
+                f.readline() # header
+            else:
+                f.seek(position)
+            lines = []
+            for _ in range(self.chunk_size):
+                line = f.readline()
+                if not line:
+                    break
+                lines.append(line)
+            position = f.tell()
+        if not lines:
+            return None, None
+        df = pd.read_csv(io.BytesIO(b''.join(lines)), header=None, names=self.columns, parse_dates=[0])
+        return ((df['datetime'].values.astype('datetime64[ns]').view('int64'),
+                 df[self.columns[1:]].to_numpy(dtype='float64')), position)
+
+    def _read_chunks(self, symbols, wakeup):
+        """
+        Reader thread: cycles over its symbols, queueing the next chunk of each
+        one with room in its queue, restricted to [start_date, end_date]. The end
+        of a symbol's range is queued as None, an error as the exception raised.
+        """
+        positions = dict((s, None) for s in symbols)
+        ended = set() # symbols past end_date, whose None is queued on the next pass
+        active = list(symbols)
+        while active and not self._stop.is_set():
+            wakeup.clear()
+            progress = False
+            for s in list(active):
+                if self._queues[s].full():
+                    continue
+                progress = True
+                # 每次最多放一个item, 队列有空位所以put不会阻塞
+                try:
+                    chunk = None
+                    if s not in ended:
+                        chunk, positions[s] = self._read_chunk(s, positions[s])
+                    if chunk is None:
+                        self._queues[s].put(None)
+                        active.remove(s)
+                        continue
+                    dates, values = chunk
+                    lo, hi = date_bounds(dates, self.start_date, self.end_date)
+                    if hi < len(dates):
+                        ended.add(s)
+                    if lo < hi:
+                        self._queues[s].put((dates[lo:hi], values[lo:hi]))
+                except Exception as e:
+                    self._queues[s].put(e)
+                    active.remove(s)
+            if not progress:
+                wakeup.wait(0.1)
+
+    def _next_chunk(self, symbol):
+        """
+        Takes the next chunk of a symbol from its queue. Returns False at the end of its data.
+        """
+        item = self._queues[symbol].get()
+        self._reader_of[symbol].set()
+        if isinstance(item, Exception):
+            raise item
+        self._chunks[symbol] = item
+        self._positions[symbol] = 0
+        return item is not None
+
+    def close(self):
+        """
+        Stops the reader threads.
+        """
+        self._stop.set()
+        for wakeup in self._wakeups:
+            wakeup.set()
+        for thread in self._threads:
+            thread.join()
+
+    def update_bars(self):
+        """
+        Appends the bar of the next timestamp for all symbols in the
+        self.symbol_list and puts a MarketEvent on the queue.
+        """
+        if not self._heap:
+            self.continue_backtest = False
+            self.events.put(MarketEvent())
+            return
+        timestamp = self._heap[0][0]
+        i = self._next_row()
+        j_adj, j_ret = self.field_index['adj_close'], self.field_index['returns']
+        # 弹出所有在这个时间点有bar的symbol
+        while self._heap and self._heap[0][0] == timestamp:
+            k = heapq.heappop(self._heap)[1]
+            s = self.symbol_list[k]
+            dates, values = self._chunks[s]
+            p = self._positions[s]
+            # 同一时间点有重复的行时取最后一行, 与union calendar一致
+            while p + 1 < len(dates) and dates[p + 1] == timestamp:
+                p += 1
+            self._last_rows[s] = values[p]
+            self._positions[s] = p + 1
+            if self._positions[s] < len(dates) or self._next_chunk(s):
+                dates = self._chunks[s][0]
+                heapq.heappush(self._heap, (dates[self._positions[s]], k))
+        for s in self.symbol_list:
+            row = self.symbol_data[s]
+            prev_adj = row[i - 1, j_adj] if i > 0 else np.nan
+            if self._last_rows[s] is None:
+                row[i] = np.nan
+            else:
+                row[i, :j_ret] = self._last_rows[s]
+                row[i, j_ret] = row[i, j_adj] / prev_adj - 1.0
+        self._commit_row(pd.Timestamp(timestamp))
+
+
+class StreamingParquetDataHandler(StreamingCSVDataHandler):
+    """
+    StreamingCSVDataHandler reading <csv_dir>/<symbol>.parquet files one row
+    group at a time (the chunks are the row groups the files were written with,
+    not chunk_size rows). The files need the columns datetime, open, high, low,
+    close, volume and adj_close, sorted by datetime. Requires pyarrow.
+    """
+    def _path(self, symbol):
+        return os.path.join(self.csv_dir, f'{symbol}.parquet')
+
+    def _read_chunk(self, symbol, position):
+        import pyarrow.parquet as pq
+
+        group = position or 0
+        with open(self._path(symbol), 'rb') as f:
+            parquet = pq.ParquetFile(f)
+            if group >= parquet.num_row_groups:
+                return None, None
+            df = parquet.read_row_group(group, columns=self.columns).to_pandas()
+        return ((pd.to_datetime(df['datetime']).values.astype('datetime64[ns]').view('int64'),
+                 df[self.columns[1:]].to_numpy(dtype='float64')), group + 1)
+
+
 ##
 #TODO: 期货, 期权数据
\ No newline at end of file
@@ -1,9 +1,28 @@
+from enum import Enum
+
+import numpy as np
+
+
+class EventType(str, Enum):
+    """
+    Type tags of the events. Being a str enum, EventType.MARKET == 'MARKET',
+    so code comparing event.type with the plain strings keeps working.
+    """
+    MARKET = 'MARKET'
+    SIGNAL = 'SIGNAL'
+    ORDER = 'ORDER'
+    FILL = 'FILL'
+
+
 class Event(object):
     """
     Event is base class providing an interface for all subsequent(inherited) events, 
     that will trigger urther eents in the trading infrasturcture.
+
+    Events use __slots__ and keep their type as a class attribute, so an instance
+    carries no __dict__ and only its own fields. Millions are created in intraday runs.
     """
-    pass
+    __slots__ = ()
 
 
 # DataHandler generates marketevents
@@ -11,35 +30,39 @@ class MarketEvent(Event):
     """
     Handles the event of receiving a new market update with corresponding bars.
     """
-    
-    def __init__(self):
-        """
-        Initialises the MarketEvent.
-        """
-        self.type = 'MARKET'
+    __slots__ = ()
+    type = EventType.MARKET
 # strategy processes marketevents and generates signalevents
 class SignalEvent(Event):
     """
     Handles the event of sending a Signal froom a Strategy object.
     This is received by a Portfolio object and acted upon.
     """
+    __slots__ = ('strategy_id', 'symbol', 'datetime', 'signal_type', 'strength',
+                 'target_quantity', 'target_weight')
+    type = EventType.SIGNAL
     
-    def __init__(self, strategy_id, symbol, datetime, signal_type, strength):
+    def __init__(self, strategy_id, symbol, datetime, signal_type, strength,
+                 target_quantity=None, target_weight=None):
         """
         strategy_id: The unique identifier for the strategy that generated the signal.
         symbol: 比如股票代码
         datetime: the timestamp at which the signal was generatd.
-        signal_type: 'LONG' or 'SHORT'
+        signal_type: 'LONG', 'SHORT', 'EXIT', or 'TARGET' for target signals
         strength: An adjustment factor "suggestion" used to scale quantity at the portfolio level. Useful for pairs strategies.
         相当于是策略的权重
+        target_quantity: signed number of shares the position should be brought to.
+        target_weight: signed fraction of the portfolio equity the position should be brought to.
+        When either is set, the Portfolio trades the difference with the current
+        position in one order, instead of its fixed-size LONG/SHORT/EXIT sizing.
         """
-        
-        self.type = 'SIGNAL'
         self.strategy_id = strategy_id
         self.symbol = symbol
         self.datetime = datetime
         self.signal_type = signal_type
         self.strength = strength
+        self.target_quantity = target_quantity
+        self.target_weight = target_weight
         
 # portfolio class receives a signalevent and translates it to a order event
 
@@ -48,21 +71,27 @@ class OrderEvent(Event):
     Handles the event of sending an Order to an execution system.
     The order contains a symbol, a type, quantity and a direction.
     """
-    def __init__(self, symbol, order_type, quantity, direction):
+    __slots__ = ('symbol', 'order_type', 'quantity', 'direction', 'strategy_id', 'price')
+    type = EventType.ORDER
+
+    def __init__(self, symbol, order_type, quantity, direction, strategy_id=None, price=None):
         """
         Initialises the order type, setting whether it is a Market order or Limit order,
         has a quantity and ites diretion.
         Parameters:
         symbol: 股票代码
-        order_type: 市价单或者限价单
+        order_type: 市价单或者限价单, 'MKT', 'LMT' or 'STP'
         quantity: 下单的数量
         direction: "BUY" or "SELL" for long or short
+        strategy_id: the strategy whose signal the order comes from, copied on its fills
+        price: the limit price of a 'LMT' order, the stop price of a 'STP' order
         """
-        self.type = "ORDER"
         self.symbol = symbol
         self.order_type = order_type
         self.quantity = quantity
         self.direction = direction
+        self.strategy_id = strategy_id
+        self.price = price
         
     def _check_set_quantity_positive(self, quantity):
         """
@@ -77,7 +106,7 @@ class OrderEvent(Event):
         Outputs the values within the Order.
         """
         print(
-            f"Order: Symbols={self.symbol}, Type={self.order_type}, Quantity={self.quantity}, Direction={self.direction}"
+            f"Order: Symbols={self.symbol}, Type={self.order_type}, Quantity={self.quantity}, Direction={self.direction}, Price={self.price}"
         )
         
 # 有了订单事件，把它传给ExecutionHander，就可以得到fillevent
@@ -87,7 +116,12 @@ class FillEvent(Event):
     Encapsulates(压缩) the notion of a FIlled Order, as returned from a brokerage.
     Stores the quantity of an insturment actually filled and at wat price. In addition, stores the commision of the trade from the brokerage.
     """
-    def __init__(self, timeindex, symbol, exchange, quantity, direction, fill_cost, commission=None):
+    __slots__ = ('timeindex', 'symbol', 'exchange', 'quantity', 'direction', 'fill_cost', 'commission',
+                 'strategy_id')
+    type = EventType.FILL
+
+    def __init__(self, timeindex, symbol, exchange, quantity, direction, fill_cost, commission=None,
+                 strategy_id=None):
         """
         Parameters:
         timeindex: The bar-resolution when the order was filled.
@@ -95,16 +129,17 @@ class FillEvent(Event):
         exchange: 交易所
         quantity: 数量
         direction: 
-        fill_cost:
+        fill_cost: price per share of the fill, None to use the bar's adj_close
         commission:
+        strategy_id: the strategy of the filled order
         """
-        
-        self.type = 'FILL'
         self.timeindex = timeindex
         self.symbol = symbol
         self.exchange = exchange
         self.quantity = quantity
         self.direction = direction
+        self.fill_cost = fill_cost
+        self.strategy_id = strategy_id
     
         if commission is None:
             self.commission = self.calculate_ib_commission()
@@ -112,10 +147,26 @@ class FillEvent(Event):
             self.commission = commission
             
     def calculate_ib_commission(self):
-        full_cost = 1.3
-        if self.quantity <= 500:
-            full_cost = max(1.3, 0.013 * self.quantity)
-        else:
-            full_cost = max(1.3, 0.008 * self.quantity)
-        return full_cost
+        return float(calculate_ib_commission(self.quantity))
+
+
+def calculate_ib_commission(quantity):
+    """
+    Interactive Brokers fixed commission schedule (USD) for a fill of `quantity` shares:
+    0.013/share up to 500 shares, 0.008/share above, with a 1.3 minimum.
+
+    Accepts a scalar or a NumPy array of quantities, so the event engine and the
+    vectorized engine charge exactly the same fees. Zero quantities cost nothing
+    (no trade, no fill).
+    """
+    if isinstance(quantity, (int, float, np.number)):
+        # Scalar fast path, taken once per FillEvent
+        quantity = abs(quantity)
+        if quantity == 0:
+            return 0.0
+        return max(1.3, 0.013 * quantity if quantity <= 500 else 0.008 * quantity)
+    quantity = np.abs(np.asarray(quantity, dtype='float64'))
+    full_cost = np.where(quantity <= 500, 0.013 * quantity, 0.008 * quantity)
+    cost = np.where(quantity == 0, 0.0, np.maximum(1.3, full_cost))
+    return cost[()] if cost.ndim == 0 else cost
     
\ No newline at end of file
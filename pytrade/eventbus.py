@@ -0,0 +1,150 @@
+from abc import ABCMeta, abstractmethod
+import asyncio
+from collections import deque
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+
+class EventBus(object):
+    """
+    EventBus is an abstract base class for the event queue shared by all the components.
+
+    Components only ever call put(); the engine registers one or more handlers per
+    event type with register() and drains the bus with dispatch_pending(). Handlers
+    of the same type are called in registration order.
+    """
+    __metaclass__ = ABCMeta
+
+    def __init__(self):
+        self.handlers = {}
+
+    def register(self, event_type, handler):
+        """
+        Registers a handler called with every event of event_type.
+        """
+        self.handlers.setdefault(event_type, []).append(handler)
+
+    def dispatch(self, event):
+        """
+        Calls the handlers registered for the type of event.
+        """
+        for handler in self.handlers.get(event.type, ()):
+            handler(event)
+
+    @abstractmethod
+    def put(self, event):
+        """
+        Adds an event to the bus.
+        """
+        raise NotImplementedError("Should implement put()")
+
+    @abstractmethod
+    def dispatch_pending(self):
+        """
+        Dispatches events until the bus is empty, including the events
+        put by the handlers themselves.
+        """
+        raise NotImplementedError("Should implement dispatch_pending()")
+
+
+class DequeEventBus(EventBus):
+    """
+    Event bus for backtests: a plain collections.deque without any locking,
+    drained in a loop that stops when the deque is empty instead of on queue.Empty.
+    Only usable from a single thread.
+    """
+    def __init__(self):
+        super(DequeEventBus, self).__init__()
+        self._events = deque()
+
+    def put(self, event):
+        if event is not None:
+            self._events.append(event)
+
+    def get(self):
+        """
+        Returns the next event, or None if the bus is empty.
+        """
+        return self._events.popleft() if self._events else None
+
+    def empty(self):
+        return not self._events
+
+    def __len__(self):
+        return len(self._events)
+
+    def dispatch_pending(self):
+        events = self._events
+        handlers = self.handlers
+        while events:
+            event = events.popleft()
+            for handler in handlers.get(event.type, ()):
+                handler(event)
+
+
+class ThreadSafeEventBus(EventBus):
+    """
+    Event bus backed by queue.Queue, for live trading where broker callbacks
+    put events from other threads.
+    """
+    def __init__(self):
+        super(ThreadSafeEventBus, self).__init__()
+        self._events = queue.Queue()
+
+    def put(self, event):
+        if event is not None:
+            self._events.put(event)
+
+    def get(self, block=True, timeout=None):
+        """
+        Returns the next event, or None if none arrives in time.
+        """
+        try:
+            return self._events.get(block, timeout)
+        except queue.Empty:
+            return None
+
+    def empty(self):
+        return self._events.empty()
+
+    def __len__(self):
+        return self._events.qsize()
+
+    def dispatch_pending(self):
+        while True:
+            event = self.get(block=False)
+            if event is None:
+                break
+            self.dispatch(event)
+
+
+class AsyncEventBus(EventBus):
+    """
+    Event bus backed by asyncio.Queue, for an asyncio live-trading engine.
+    put() never blocks, so synchronous components can keep calling it.
+    """
+    def __init__(self):
+        super(AsyncEventBus, self).__init__()
+        self._events = asyncio.Queue()
+
+    def put(self, event):
+        if event is not None:
+            self._events.put_nowait(event)
+
+    async def get(self):
+        """
+        Waits for and returns the next event.
+        """
+        return await self._events.get()
+
+    def empty(self):
+        return self._events.empty()
+
+    def __len__(self):
+        return self._events.qsize()
+
+    def dispatch_pending(self):
+        while not self._events.empty():
+            self.dispatch(self._events.get_nowait())
@@ -1,11 +1,13 @@
 from abc import ABCMeta, abstractmethod
-import datetime
+from collections import deque
+import heapq
 try:
     import Queue as queue
 except ImportError:
     import queue
 
-from .event import FillEvent, OrderEvent
+from .clock import WallClock
+from .event import EventType, FillEvent, OrderEvent
 
 class ExecutionHandler(object):
     """
@@ -18,6 +20,9 @@ class ExecutionHandler(object):
     """
     
     __metaclass__ = ABCMeta
+
+    # FeeSchedule charged on the fills; None keeps FillEvent's IB commission
+    fee_schedule = None
     
     @abstractmethod
     def execute_order(self, event):
@@ -29,6 +34,29 @@ class ExecutionHandler(object):
         event: Contains an Event object with order information.
         """
         raise NotImplementedError("Should implement execute_order()")
+
+    def on_market(self, event):
+        """
+        Called by the Backtest on every MarketEvent, before the strategies.
+        Handlers with resting orders match them against the new bar here.
+        """
+        pass
+
+    def pending_quantities(self, strategy_id=None):
+        """
+        Returns symbol -> signed quantity (buys positive) of the orders accepted
+        but not filled yet, of strategy_id only if given. Empty for handlers
+        filling every order right away.
+        """
+        return {}
+
+    def _commission(self, quantity, direction, price):
+        """
+        Returns the fee_schedule's fees of a fill, or None without a schedule.
+        """
+        if self.fee_schedule is None:
+            return None
+        return self.fee_schedule.fill_cost(quantity, direction, price)
     
 class SimulatedExecutionHandler(ExecutionHandler):
     """
@@ -40,11 +68,19 @@ class SimulatedExecutionHandler(ExecutionHandler):
     before implementation with a more sophisticated execution handler. 
     """
     
-    def __init__(self, events):
+    def __init__(self, events, clock=None, bars=None):
         """
         Initialises the handler, setting the event queues up internally.
+
+        Parameters:
+        events: The Event Queue object
+        clock: Clock stamping the fills, the wall clock if None. The Backtest
+        passes its SimulatedClock, so fills carry the bar datetime.
+        bars: DataHandler pricing the fills for a fee_schedule, clock.bars if None
         """
         self.events = events
+        self.clock = clock if clock is not None else WallClock(None)
+        self.bars = bars if bars is not None else self.clock.bars
         
     def execute_order(self, event):
         """
@@ -54,7 +90,240 @@ class SimulatedExecutionHandler(ExecutionHandler):
         Parameters:
         event: Contains an Event object with order information.
         """
-        if event.type == "ORDER":
-            fill_event = FillEvent(datetime.datetime.utcnow(), event.symbol, 'ARCA', #FIXME: 修改时间
-                                   event.quantity, event.direction, None)
+        if event.type == EventType.ORDER:
+            commission = None
+            if self.fee_schedule is not None:
+                price = self.bars.get_latest_bar_value(event.symbol, 'adj_close')
+                commission = self._commission(event.quantity, event.direction, price)
+            fill_event = FillEvent(self.clock.now(), event.symbol, 'ARCA',
+                                   event.quantity, event.direction, None, commission,
+                                   strategy_id=event.strategy_id)
             self.events.put(fill_event)
+
+
+class _OrderBook(object):
+    """
+    Resting orders of one symbol, indexed by price so that a bar only touches
+    the orders it triggers:
+
+    - buy limits in a max-heap and sell limits in a min-heap on the limit price,
+      so the orders within the bar's range are popped from the top;
+    - buy stops in a min-heap and sell stops in a max-heap on the stop price;
+    - market orders (and triggered stops) in a FIFO queue.
+
+    Heap entries are [key, seq, order, remaining]; seq gives time priority at equal prices.
+    """
+    def __init__(self):
+        self.market = deque()
+        self.buy_limits = []
+        self.sell_limits = []
+        self.buy_stops = []
+        self.sell_stops = []
+
+    def __len__(self):
+        return (len(self.market) + len(self.buy_limits) + len(self.sell_limits)
+                + len(self.buy_stops) + len(self.sell_stops))
+
+    def add(self, seq, order, remaining):
+        if order.order_type == 'LMT':
+            if order.direction == 'BUY':
+                heapq.heappush(self.buy_limits, [-order.price, seq, order, remaining])
+            else:
+                heapq.heappush(self.sell_limits, [order.price, seq, order, remaining])
+        elif order.order_type == 'STP':
+            if order.direction == 'BUY':
+                heapq.heappush(self.buy_stops, [order.price, seq, order, remaining])
+            else:
+                heapq.heappush(self.sell_stops, [-order.price, seq, order, remaining])
+        else:
+            self.market.append([None, seq, order, remaining])
+
+
+class MatchingEngineExecutionHandler(ExecutionHandler):
+    """
+    A simulated exchange: orders rest in a per-symbol _OrderBook and are matched
+    against the OHLC of the following bars (a tick is a bar with O=H=L=C).
+
+    - An order becomes active `latency` bars after it is sent. With latency 0 it is
+      matched at once against the close of the current bar, and rests if it cannot fill.
+    - MKT orders fill at the open. A buy LMT fills at the open if the open is at or
+      below the limit, else at the limit if the low reaches it (sells mirrored).
+      A buy STP triggers at the open if the open is at or above the stop, else at the
+      stop if the high reaches it, and then fills like a market order.
+    - MKT and triggered STP fills pay `slippage`, a fraction of the price, against
+      the order. LMT fills never get a worse price than the limit.
+    - If max_volume_fraction is set, at most that fraction of the bar's volume is
+      filled per symbol and bar; the rest of the orders stays in the book (partial
+      fills). Unfilled market orders are retried at the next open.
+
+    Prices are matched on the raw OHLC, and the fill price is converted to the
+    adj_close scale the Portfolio marks with (times adj_close / close of the bar).
+
+    The settings are class attributes, overridable per instance.
+    """
+    bar_fields = ['open', 'high', 'low', 'close', 'volume', 'adj_close']
+    latency = 1
+    slippage = 0.0
+    max_volume_fraction = None
+    exchange = 'SIM'
+
+    def __init__(self, events, clock=None, bars=None, latency=None, slippage=None,
+                 max_volume_fraction=None):
+        """
+        Parameters:
+        events: The Event Queue object
+        clock: Clock stamping the fills
+        bars: DataHandler with the bars to match against, clock.bars if None
+        latency, slippage, max_volume_fraction: override the class attributes
+        """
+        self.events = events
+        self.clock = clock if clock is not None else WallClock(None)
+        self.bars = bars if bars is not None else self.clock.bars
+        if latency is not None:
+            self.latency = latency
+        if slippage is not None:
+            self.slippage = slippage
+        if max_volume_fraction is not None:
+            self.max_volume_fraction = max_volume_fraction
+        self.books = {} # symbol -> _OrderBook
+        self.pending = deque() # (activation bar, seq, order), 还在路上的订单
+        self.seq = 0
+
+    def _bar(self, symbol):
+        """
+        Returns (open, high, low, close, volume, adj_close) of the latest bar, or None.
+        """
+        block = self.bars.get_latest_bars_block(symbol, self.bar_fields, N=1)
+        return tuple(block[0]) if len(block) else None
+
+    def _liquidity(self, bar):
+        if self.max_volume_fraction is None:
+            return float('inf')
+        return int(self.max_volume_fraction * bar[4])
+
+    def _fill(self, order, quantity, price, bar, slipped):
+        """
+        Puts a FillEvent of quantity shares at price (raw scale).
+        """
+        if slipped and self.slippage:
+            price *= 1.0 + self.slippage if order.direction == 'BUY' else 1.0 - self.slippage
+        price *= bar[5] / bar[3] if bar[3] else 1.0
+        self.events.put(FillEvent(
+            self.clock.now(), order.symbol, self.exchange, quantity, order.direction,
+            price, self._commission(quantity, order.direction, price), strategy_id=order.strategy_id
+        ))
+
+    def _take(self, entry, price, bar, available, slipped):
+        """
+        Fills as much of a book entry as the bar's liquidity allows.
+        Returns the liquidity left.
+        """
+        quantity = min(entry[3], available)
+        if quantity > 0:
+            self._fill(entry[2], quantity, price, bar, slipped)
+            entry[3] -= quantity
+        return available - quantity
+
+    def _match(self, book, bar, at_close=False):
+        """
+        Matches the book of one symbol against a bar. With at_close, only the
+        close is known (orders sent with latency 0).
+        """
+        o, h, l, c = (bar[3],) * 4 if at_close else bar[:4]
+        available = self._liquidity(bar)
+
+        # Stops first: the triggered ones join the market orders at their trigger price
+        triggered = []
+        while book.buy_stops and book.buy_stops[0][0] <= h:
+            entry = heapq.heappop(book.buy_stops)
+            entry[0] = max(o, entry[2].price)
+            triggered.append(entry)
+        while book.sell_stops and -book.sell_stops[0][0] >= l:
+            entry = heapq.heappop(book.sell_stops)
+            entry[0] = min(o, entry[2].price)
+            triggered.append(entry)
+        triggered.sort(key=lambda entry: entry[1])
+
+        # Market orders at the open, in time priority
+        for entry in list(book.market) + triggered:
+            if available <= 0:
+                break
+            available = self._take(entry, o if entry[0] is None else entry[0], bar, available, True)
+        book.market = deque(e for e in book.market if e[3] > 0)
+        for entry in triggered:
+            if entry[3] > 0:
+                entry[0] = None # the rest is a market order now
+                book.market.append(entry)
+
+        # Limits within the bar's range, best price first
+        while available > 0 and book.buy_limits and -book.buy_limits[0][0] >= l:
+            entry = book.buy_limits[0]
+            available = self._take(entry, min(o, -entry[0]), bar, available, False)
+            if entry[3] == 0:
+                heapq.heappop(book.buy_limits)
+        while available > 0 and book.sell_limits and book.sell_limits[0][0] <= h:
+            entry = book.sell_limits[0]
+            available = self._take(entry, max(o, entry[0]), bar, available, False)
+            if entry[3] == 0:
+                heapq.heappop(book.sell_limits)
+
+    def _book(self, symbol):
+        if symbol not in self.books:
+            self.books[symbol] = _OrderBook()
+        return self.books[symbol]
+
+    def execute_order(self, event):
+        """
+        Sends an order to the book, active after `latency` bars.
+        """
+        if event.type == EventType.ORDER:
+            if event.order_type not in ('MKT', 'LMT', 'STP'):
+                print(f"Unsupported order type {event.order_type}, order dropped")
+                return
+            if event.order_type != 'MKT' and event.price is None:
+                print(f"{event.order_type} order without a price, order dropped")
+                return
+            self.seq += 1
+            if self.latency > 0:
+                self.pending.append((self.bars.bar_index + self.latency, self.seq, event))
+                return
+            book = self._book(event.symbol)
+            book.add(self.seq, event, event.quantity)
+            bar = self._bar(event.symbol)
+            if bar is not None:
+                self._match(book, bar, at_close=True)
+
+    def on_market(self, event):
+        """
+        Activates the orders arriving on this bar and matches all the books
+        with resting orders against the new bar.
+        """
+        while self.pending and self.pending[0][0] <= self.bars.bar_index:
+            _, seq, order = self.pending.popleft()
+            self._book(order.symbol).add(seq, order, order.quantity)
+        for symbol, book in self.books.items():
+            if len(book):
+                bar = self._bar(symbol)
+                if bar is not None and bar[0] == bar[0]: # 没有数据(NaN)的bar不撮合
+                    self._match(book, bar)
+
+    def open_orders(self):
+        """
+        Returns the number of orders in flight or resting in the books.
+        """
+        return len(self.pending) + sum(len(book) for book in self.books.values())
+
+    def pending_quantities(self, strategy_id=None):
+        """
+        Returns symbol -> signed remaining quantity of the orders in flight or resting in the books.
+        """
+        pending = {}
+        entries = [(order, order.quantity) for _, _, order in self.pending]
+        for book in self.books.values():
+            for side in (book.market, book.buy_limits, book.sell_limits, book.buy_stops, book.sell_stops):
+                entries.extend((order, remaining) for _, _, order, remaining in side)
+        for order, remaining in entries:
+            if strategy_id is None or order.strategy_id == strategy_id:
+                quantity = remaining if order.direction == 'BUY' else -remaining
+                pending[order.symbol] = pending.get(order.symbol, 0) + quantity
+        return pending
@@ -0,0 +1,206 @@
+from abc import ABCMeta, abstractmethod
+
+import numpy as np
+
+# 手续费模块: 每个Fee对一笔(或一组)成交计算费用.
+# quantity为带符号的成交数量(买为正, 卖为负), price为成交价格.
+# 标量和NumPy数组走同一段代码, 因此事件驱动和向量化回测的结果完全一致.
+
+
+def _result(cost, scalar):
+    return float(cost) if scalar else cost
+
+
+class Fee(object):
+    """
+    Fee is an abstract base class for one component of a fee schedule.
+
+    trade_cost() charges a fill, holding_cost() charges a position held for
+    one bar (e.g. borrow fees). Both take scalars or arrays of the same shape
+    and return the same values either way; a zero quantity costs nothing.
+    """
+    __metaclass__ = ABCMeta
+
+    @abstractmethod
+    def trade_cost(self, quantity, price):
+        """
+        Returns the fee of fills of signed `quantity` shares at `price`.
+        """
+        raise NotImplementedError("Should implement trade_cost()")
+
+    def holding_cost(self, position, price):
+        """
+        Returns the fee of holding signed `position` shares marked at `price` for one bar.
+        """
+        return np.zeros(np.shape(position)) if np.ndim(position) else 0.0
+
+
+def _capped(cost, quantity, price, minimum, maximum, max_value_rate):
+    """
+    Applies a per-fill minimum and maximum (absolute, and as a fraction of the
+    traded value) to the costs of non-zero fills.
+    """
+    if minimum is not None:
+        cost = np.maximum(cost, minimum)
+    if maximum is not None:
+        cost = np.minimum(cost, maximum)
+    if max_value_rate is not None:
+        cost = np.minimum(cost, max_value_rate * np.abs(quantity) * price)
+    return np.where(quantity == 0, 0.0, cost)
+
+
+class PerShareFee(Fee):
+    """
+    Per-share commission with volume tiers.
+
+    Parameters:
+    tiers: list of (upto, rate) sorted by upto, the last upto may be None (no limit),
+    e.g. [(500, 0.013), (None, 0.008)]
+    marginal: if False, the rate of the tier the fill size falls in applies to the
+    whole fill (Interactive Brokers fixed); if True, each tier's rate applies
+    to the shares within it
+    minimum, maximum: per fill, in currency
+    max_value_rate: per fill cap as a fraction of the traded value, e.g. 0.01
+    """
+    def __init__(self, tiers, marginal=False, minimum=None, maximum=None, max_value_rate=None):
+        self.bounds = np.array([np.inf if upto is None else upto for upto, rate in tiers], dtype='float64')
+        self.rates = np.array([rate for upto, rate in tiers], dtype='float64')
+        self.marginal = marginal
+        self.minimum = minimum
+        self.maximum = maximum
+        self.max_value_rate = max_value_rate
+
+    def trade_cost(self, quantity, price):
+        scalar = np.ndim(quantity) == 0
+        quantity = np.asarray(quantity, dtype='float64')
+        price = np.asarray(price, dtype='float64')
+        size = np.abs(quantity)
+        if self.marginal:
+            lower = np.concatenate([[0.0], self.bounds[:-1]])
+            shares = np.clip(size[..., None] - lower, 0.0, self.bounds - lower)
+            cost = (shares * self.rates).sum(axis=-1)
+        else:
+            tier = np.minimum(np.searchsorted(self.bounds, size, side='left'), len(self.rates) - 1)
+            cost = self.rates[tier] * size
+        cost = _capped(cost, quantity, price, self.minimum, self.maximum, self.max_value_rate)
+        return _result(cost, scalar)
+
+
+class PerValueFee(Fee):
+    """
+    Commission as a fraction of the traded value, e.g. 0.0005 for 5 bps.
+
+    Parameters:
+    rate: fraction of abs(quantity) * price
+    minimum, maximum: per fill, in currency
+    """
+    def __init__(self, rate, minimum=None, maximum=None):
+        self.rate = rate
+        self.minimum = minimum
+        self.maximum = maximum
+
+    def trade_cost(self, quantity, price):
+        scalar = np.ndim(quantity) == 0
+        quantity = np.asarray(quantity, dtype='float64')
+        cost = self.rate * np.abs(quantity) * np.asarray(price, dtype='float64')
+        cost = _capped(cost, quantity, price, self.minimum, self.maximum, None)
+        return _result(cost, scalar)
+
+
+class ExchangeFee(Fee):
+    """
+    Exchange and regulatory fees, per share and/or per value, optionally on
+    one side only (e.g. the SEC fee is charged on sales).
+
+    Parameters:
+    per_share: fee per share
+    per_value: fee as a fraction of the traded value
+    side: 'BUY', 'SELL' or None for both
+    maximum: per fill cap, in currency
+    """
+    def __init__(self, per_share=0.0, per_value=0.0, side=None, maximum=None):
+        self.per_share = per_share
+        self.per_value = per_value
+        self.side = side
+        self.maximum = maximum
+
+    def trade_cost(self, quantity, price):
+        scalar = np.ndim(quantity) == 0
+        quantity = np.asarray(quantity, dtype='float64')
+        size = np.abs(quantity)
+        cost = self.per_share * size + self.per_value * size * np.asarray(price, dtype='float64')
+        if self.maximum is not None:
+            cost = np.minimum(cost, self.maximum)
+        if self.side == 'BUY':
+            cost = np.where(quantity > 0, cost, 0.0)
+        elif self.side == 'SELL':
+            cost = np.where(quantity < 0, cost, 0.0)
+        cost = np.where(quantity == 0, 0.0, cost) # 未上市的symbol价格为NaN, 数量为0
+        return _result(cost, scalar)
+
+
+class BorrowFee(Fee):
+    """
+    Borrow cost of short positions: annual_rate of the short market value,
+    accrued over `periods` bars a year. No cost on fills.
+    """
+    def __init__(self, annual_rate, periods=252):
+        self.annual_rate = annual_rate
+        self.periods = periods
+
+    def trade_cost(self, quantity, price):
+        return np.zeros(np.shape(quantity)) if np.ndim(quantity) else 0.0
+
+    def holding_cost(self, position, price):
+        scalar = np.ndim(position) == 0
+        position = np.asarray(position, dtype='float64')
+        short = np.where(position < 0, -position, 0.0)
+        cost = np.where(short > 0, self.annual_rate / self.periods * short * np.asarray(price, dtype='float64'), 0.0)
+        return _result(cost, scalar)
+
+
+class FeeSchedule(object):
+    """
+    The sum of several Fee components.
+
+    trade_cost() and holding_cost() accept scalars for the event engine (one fill,
+    one position) or arrays for the vectorized engine (e.g. a bars x symbols
+    array of trades), with identical results.
+
+    Parameters:
+    fees: Fee instances
+    """
+    def __init__(self, *fees):
+        self.fees = list(fees)
+        self.has_holding_cost = any(
+            type(fee).holding_cost is not Fee.holding_cost for fee in self.fees
+        )
+
+    def trade_cost(self, quantity, price):
+        """
+        Returns the fees of fills of signed `quantity` shares at `price`.
+        """
+        total = np.zeros(np.shape(quantity)) if np.ndim(quantity) else 0.0
+        for fee in self.fees:
+            total = total + fee.trade_cost(quantity, price)
+        return total
+
+    def holding_cost(self, position, price):
+        """
+        Returns the fees of holding signed `position` shares at `price` for one bar.
+        """
+        total = np.zeros(np.shape(position)) if np.ndim(position) else 0.0
+        for fee in self.fees:
+            total = total + fee.holding_cost(position, price)
+        return total
+
+    def fill_cost(self, quantity, direction, price):
+        """
+        Returns the fees of one fill given as a positive quantity and a 'BUY'/'SELL' direction.
+        """
+        return self.trade_cost(quantity if direction == 'BUY' else -quantity, price)
+
+
+# Interactive Brokers fixed schedule, the same as event.calculate_ib_commission
+# for non-zero quantities
+IB_FIXED = FeeSchedule(PerShareFee([(500, 0.013), (None, 0.008)], minimum=1.3))
@@ -0,0 +1,335 @@
+from collections import deque
+import math
+
+import numpy as np
+
+# 流式指标: 每来一个bar, update()一次, 代价是O(1), 与窗口长度无关.
+# 指标可以注册到DataHandler上(register_indicator), 由update_bars自动更新.
+
+
+class Indicator(object):
+    """
+    Base class of the streaming indicators. update() takes the newest value(s)
+    and returns the current value of the indicator, also kept in self.value
+    (NaN until the first update).
+    """
+    def __init__(self):
+        self.value = np.nan
+        self.count = 0
+
+    def update(self, x):
+        raise NotImplementedError("Should implement update()")
+
+
+class SMA(Indicator):
+    """
+    Simple moving average over the last `window` values, or over all the values
+    while fewer are available.
+    """
+    def __init__(self, window):
+        super(SMA, self).__init__()
+        self.window = window
+        self._values = deque()
+        self._sum = 0.0
+
+    def update(self, x):
+        self._values.append(x)
+        self._sum += x
+        if len(self._values) > self.window:
+            self._sum -= self._values.popleft()
+        self.count += 1
+        self.value = self._sum / len(self._values)
+        return self.value
+
+
+class EMA(Indicator):
+    """
+    Exponential moving average with alpha = 2 / (span + 1), started at the first
+    value (pandas ewm(span=span, adjust=False)).
+    """
+    def __init__(self, span):
+        super(EMA, self).__init__()
+        self.span = span
+        self.alpha = 2.0 / (span + 1.0)
+
+    def update(self, x):
+        if self.count == 0:
+            self.value = x
+        else:
+            self.value += self.alpha * (x - self.value)
+        self.count += 1
+        return self.value
+
+
+class RollingVariance(Indicator):
+    """
+    Variance of the last `window` values, updated with Welford's add/remove
+    steps, which stay accurate where sum-of-squares formulas cancel out.
+    """
+    def __init__(self, window, ddof=1):
+        super(RollingVariance, self).__init__()
+        self.window = window
+        self.ddof = ddof
+        self._values = deque()
+        self.mean = np.nan
+        self.variance = np.nan
+        self._m2 = 0.0
+
+    def update(self, x):
+        self._values.append(x)
+        n = len(self._values)
+        if n == 1:
+            self.mean = x
+            self._m2 = 0.0
+        else:
+            delta = x - self.mean
+            self.mean += delta / n
+            self._m2 += delta * (x - self.mean)
+        if n > self.window:
+            old = self._values.popleft()
+            n -= 1
+            delta = old - self.mean
+            self.mean -= delta / n
+            self._m2 -= delta * (old - self.mean)
+        self.count += 1
+        self.variance = max(self._m2, 0.0) / (n - self.ddof) if n > self.ddof else np.nan
+        self.value = self.variance
+        return self.value
+
+    @property
+    def std(self):
+        return math.sqrt(self.variance) if self.variance == self.variance else np.nan
+
+
+class RollingZScore(RollingVariance):
+    """
+    Z-score of the newest value against the mean and standard deviation of the
+    last `window` values (itself included).
+    """
+    def update(self, x):
+        super(RollingZScore, self).update(x)
+        std = self.std
+        self.value = (x - self.mean) / std if std > 0 else np.nan
+        return self.value
+
+
+class RollingBeta(Indicator):
+    """
+    Rolling OLS slope of y on x over the last `window` pairs, from running sums.
+    Without intercept (the default, like sm.OLS(y, x)) beta = sum(xy) / sum(xx).
+
+    residual_zscore() gives the z-score of the newest residual y - beta * x among
+    the window's residuals, using the same sums, so pairs strategies need no
+    regression per bar.
+    """
+    def __init__(self, window, intercept=False):
+        super(RollingBeta, self).__init__()
+        self.window = window
+        self.intercept = intercept
+        self._pairs = deque()
+        self.sx = self.sy = self.sxx = self.syy = self.sxy = 0.0
+        self.last = (np.nan, np.nan)
+
+    def _add(self, y, x, sign):
+        self.sx += sign * x
+        self.sy += sign * y
+        self.sxx += sign * x * x
+        self.syy += sign * y * y
+        self.sxy += sign * x * y
+
+    def update(self, y, x):
+        self._pairs.append((y, x))
+        self._add(y, x, 1.0)
+        if len(self._pairs) > self.window:
+            self._add(*self._pairs.popleft(), sign=-1.0)
+        self.count += 1
+        self.last = (y, x)
+
+        n = len(self._pairs)
+        if self.intercept:
+            den = n * self.sxx - self.sx * self.sx
+            self.value = (n * self.sxy - self.sx * self.sy) / den if den != 0 else np.nan
+        else:
+            self.value = self.sxy / self.sxx if self.sxx != 0 else np.nan
+        return self.value
+
+    def residual_zscore(self, ddof=0):
+        """
+        Z-score of the newest residual y - beta * x against the residuals of the window.
+        """
+        n = len(self._pairs)
+        if n <= ddof:
+            return np.nan
+        b = self.value
+        mean = (self.sy - b * self.sx) / n
+        ss = (self.syy - 2.0 * b * self.sxy + b * b * self.sxx) - n * mean * mean
+        var = ss / (n - ddof)
+        if not var > 0:
+            return np.nan
+        y, x = self.last
+        return (y - b * x - mean) / math.sqrt(var)
+
+
+class _RollingExtreme(Indicator):
+    """
+    Rolling min/max over the last `window` values with a monotonic deque:
+    each value is pushed and popped at most once, O(1) amortised per update.
+    """
+    def __init__(self, window):
+        super(_RollingExtreme, self).__init__()
+        self.window = window
+        self._deque = deque() # (position, value), values monotonic
+
+    def _dominates(self, new, old):
+        raise NotImplementedError
+
+    def update(self, x):
+        d = self._deque
+        while d and self._dominates(x, d[-1][1]):
+            d.pop()
+        d.append((self.count, x))
+        if d[0][0] <= self.count - self.window:
+            d.popleft()
+        self.count += 1
+        self.value = d[0][1]
+        return self.value
+
+
+class RollingMax(_RollingExtreme):
+    """
+    Maximum of the last `window` values.
+    """
+    def _dominates(self, new, old):
+        return new >= old
+
+
+class RollingMin(_RollingExtreme):
+    """
+    Minimum of the last `window` values.
+    """
+    def _dominates(self, new, old):
+        return new <= old
+
+
+class RollingPairsOLS(object):
+    """
+    Rolling OLS of y on x for many pairs at once, updated with vectorized running
+    sums: each update costs O(pairs) whatever the window, instead of one regression
+    per pair per bar.
+
+    Running sums lose precision as values are added and removed, so the sums are
+    recomputed exactly from the window every `recompute_every` updates, and
+    immediately whenever a denominator has cancelled down to less than `drift_tol`
+    of its magnitude (e.g. a nearly constant series).
+
+    Parameters:
+    pairs: list of (y_symbol, x_symbol)
+    window: lookback of the regressions
+    intercept: fit y = a + b * x instead of y = b * x (the latter is sm.OLS(y, x))
+    recompute_every: updates between two exact recomputations, defaults to window
+    drift_tol: relative size under which a denominator triggers a recomputation
+    """
+    def __init__(self, pairs, window, intercept=False, recompute_every=None, drift_tol=1e-9):
+        self.pairs = list(pairs)
+        self.window = window
+        self.intercept = intercept
+        self.recompute_every = recompute_every or window
+        self.drift_tol = drift_tol
+
+        # 所有pair用到的symbol, 每个bar只取一次价格
+        self.symbols = sorted(set(s for pair in self.pairs for s in pair))
+        ids = dict((s, i) for i, s in enumerate(self.symbols))
+        self.y_ids = np.array([ids[y] for y, x in self.pairs], dtype=int)
+        self.x_ids = np.array([ids[x] for y, x in self.pairs], dtype=int)
+
+        n = len(self.pairs)
+        self._y = np.zeros((window, n))
+        self._x = np.zeros((window, n))
+        self.count = 0
+        self._since_recompute = 0
+        self.sx, self.sy, self.sxx, self.syy, self.sxy = [np.zeros(n) for _ in range(5)]
+        self.beta = np.full(n, np.nan)
+        self.alpha = np.zeros(n)
+        self.last_y = np.full(n, np.nan)
+        self.last_x = np.full(n, np.nan)
+
+    @property
+    def n(self):
+        """
+        Number of observations in the current window.
+        """
+        return min(self.count, self.window)
+
+    def _recompute(self):
+        """
+        Recomputes the running sums exactly from the window.
+        """
+        y, x = self._y[:self.n], self._x[:self.n]
+        self.sx, self.sy = x.sum(axis=0), y.sum(axis=0)
+        self.sxx, self.syy, self.sxy = (x * x).sum(axis=0), (y * y).sum(axis=0), (x * y).sum(axis=0)
+        self._since_recompute = 0
+
+    def _denominator(self):
+        if self.intercept:
+            return self.n * self.sxx - self.sx * self.sx, self.n * self.sxx
+        return self.sxx, self.sxx
+
+    def update(self, y, x):
+        """
+        Adds one observation per pair (arrays in the order of self.pairs) and
+        returns the updated hedge ratios.
+        """
+        y = np.asarray(y, dtype='float64')
+        x = np.asarray(x, dtype='float64')
+        i = self.count % self.window
+        if self.count >= self.window:
+            oy, ox = self._y[i], self._x[i]
+            self.sx -= ox
+            self.sy -= oy
+            self.sxx -= ox * ox
+            self.syy -= oy * oy
+            self.sxy -= ox * oy
+        self._y[i], self._x[i] = y, x
+        self.sx += x
+        self.sy += y
+        self.sxx += x * x
+        self.syy += y * y
+        self.sxy += x * y
+        self.count += 1
+        self._since_recompute += 1
+        self.last_y, self.last_x = y, x
+
+        den, scale = self._denominator()
+        if self._since_recompute >= self.recompute_every or np.any(np.abs(den) <= self.drift_tol * np.abs(scale)):
+            self._recompute()
+            den, scale = self._denominator()
+
+        n = self.n
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if self.intercept:
+                self.beta = (n * self.sxy - self.sx * self.sy) / den
+                self.alpha = (self.sy - self.beta * self.sx) / n
+            else:
+                self.beta = self.sxy / den
+        return self.beta
+
+    def update_from_bars(self, bars, field='close'):
+        """
+        Feeds the latest bar values of all the pairs from a DataHandler.
+        """
+        prices = np.array([bars.get_latest_bar_value(s, field) for s in self.symbols])
+        return self.update(prices[self.y_ids], prices[self.x_ids])
+
+    def residual_zscore(self, ddof=0):
+        """
+        Z-scores of the newest spreads y - beta * x against the spreads of the
+        window, computed from the running sums (like the rolling
+        ((spread - spread.mean()) / spread.std())[-1] of a pairs strategy).
+        """
+        n = self.n
+        b = self.beta
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = (self.sy - b * self.sx) / n
+            ss = (self.syy - 2.0 * b * self.sxy + b * b * self.sxx) - n * mean * mean
+            std = np.sqrt(np.where(ss > 0, ss, np.nan) / (n - ddof))
+            return (self.last_y - b * self.last_x - mean) / std
@@ -0,0 +1,365 @@
+import asyncio
+import json
+
+import numpy as np
+import pandas as pd
+
+from .datahandler import BufferedDataHandler
+from .event import EventType, FillEvent
+from .execution import ExecutionHandler
+
+# 与broker之间的协议: 每行一个json消息
+# broker -> client:
+#   {"type": "bar", "datetime": "...", "bars": {symbol: {"open": .., "high": .., "low": .., "close": .., "volume": .., "adj_close": ..}}}
+#   {"type": "end"}                                   no more market data
+#   {"type": "ack", "order_id": 1}
+#   {"type": "fill", "order_id": 1, "datetime": "...", "symbol": .., "quantity": .., "direction": .., "price": .., "commission": ..}
+#   {"type": "error", "order_id": 1, "message": ".."}
+# client -> broker:
+#   {"type": "order", "order_id": 1, "symbol": .., "order_type": "MKT", "quantity": .., "direction": "BUY",
+#    "datetime": "..."}                               optional, the client's latest bar when the order was sent
+
+
+class BrokerConnection(object):
+    """
+    A newline delimited JSON connection to a broker or market data server.
+    """
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        return self
+
+    def send(self, msg):
+        """
+        Queues a message on the socket without waiting.
+        """
+        self.writer.write((json.dumps(msg) + '\n').encode())
+
+    async def messages(self):
+        """
+        Yields the messages of the server until it closes the connection.
+        """
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                break
+            yield json.loads(line)
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except ConnectionError:
+                pass
+
+
+class LiveDataHandler(BufferedDataHandler):
+    """
+    A data handler fed with the bar messages of a market data connection,
+    appended to bounded buffers (see BufferedDataHandler).
+    """
+
+    def on_message(self, msg):
+        """
+        Handles a market data message, ignoring the other ones.
+        """
+        if msg['type'] == 'bar':
+            self.append_bar(pd.Timestamp(msg['datetime']), msg['bars'])
+        elif msg['type'] == 'end':
+            self.continue_backtest = False
+
+    def append_bar(self, bar_datetime, bars):
+        """
+        Appends one bar for all symbols (padding missing symbols with their
+        previous bar, with returns 0 as on the union calendar of
+        HistoricCSVDataHandler) and puts a MarketEvent on the queue.
+        """
+        i = self._next_row()
+        j_adj, j_ret = self.field_index['adj_close'], self.field_index['returns']
+        for s in self.symbol_list:
+            row = self.symbol_data[s]
+            if s in bars:
+                for f, v in bars[s].items():
+                    if f in self.field_index:
+                        row[i, self.field_index[f]] = v
+            elif i > 0:
+                row[i, :j_ret] = row[i - 1, :j_ret]
+            # 补齐的行价格不变, returns为0; 还没有bar的symbol为NaN
+            row[i, j_ret] = row[i, j_adj] / row[i - 1, j_adj] - 1.0 if i > 0 else np.nan
+        self._commit_row(bar_datetime)
+
+    def update_bars(self):
+        """
+        Bars are pushed by the connection through on_message().
+        """
+        pass
+
+
+class SocketExecutionHandler(ExecutionHandler):
+    """
+    Sends orders to a broker over a BrokerConnection and turns its fill
+    messages into FillEvents. Like IBexecutionHandler, the orders in flight are
+    tracked in fill_dict, keyed by order id.
+    """
+    def __init__(self, events, connection, exchange='SIM', bars=None):
+        """
+        Parameters:
+        events: The Event Queue object
+        connection: a connected BrokerConnection
+        exchange: exchange recorded on the fills
+        bars: the LiveDataHandler, if given the datetime of its latest bar is sent with the orders
+        """
+        self.events = events
+        self.connection = connection
+        self.exchange = exchange
+        self.bars = bars
+        self.fill_dict = {}
+        self.order_id = 1
+
+    def execute_order(self, event):
+        if event.type == EventType.ORDER:
+            self.fill_dict[self.order_id] = {
+                'symbol': event.symbol,
+                'quantity': event.quantity,
+                'direction': event.direction,
+                'strategy_id': event.strategy_id,
+                'acked': False,
+                'filled': False,
+            }
+            msg = {
+                'type': 'order', 'order_id': self.order_id, 'symbol': event.symbol,
+                'order_type': event.order_type, 'quantity': event.quantity,
+                'direction': event.direction,
+            }
+            if self.bars is not None and self.bars.bar_index > 0:
+                msg['datetime'] = str(self.bars.get_latest_bar_datetime(event.symbol))
+            self.connection.send(msg)
+            self.order_id += 1
+
+    def in_flight(self):
+        """
+        Returns the number of orders sent but not yet filled.
+        """
+        return sum(1 for entry in self.fill_dict.values() if not entry['filled'])
+
+    def pending_quantities(self, strategy_id=None):
+        pending = {}
+        for entry in self.fill_dict.values():
+            if not entry['filled'] and (strategy_id is None or entry['strategy_id'] == strategy_id):
+                quantity = entry['quantity'] if entry['direction'] == 'BUY' else -entry['quantity']
+                pending[entry['symbol']] = pending.get(entry['symbol'], 0) + quantity
+        return pending
+
+    def on_message(self, msg):
+        """
+        Handles an order acknowledgement, fill or error, ignoring the other messages.
+        """
+        if msg['type'] == 'ack':
+            self.fill_dict[msg['order_id']]['acked'] = True
+        elif msg['type'] == 'fill':
+            entry = self.fill_dict[msg['order_id']]
+            if not entry['filled']:
+                entry['filled'] = True
+                self.events.put(FillEvent(
+                    pd.Timestamp(msg['datetime']), msg['symbol'], self.exchange,
+                    msg['quantity'], msg['direction'], msg['price'], msg.get('commission'),
+                    strategy_id=entry['strategy_id']
+                ))
+        elif msg['type'] == 'error':
+            print(f"Server Error: {msg}")
+            if msg.get('order_id') in self.fill_dict:
+                self.fill_dict[msg['order_id']]['filled'] = True # nothing more will come for it
+
+
+class LiveTradingEngine(object):
+    """
+    Asyncio engine driving the Strategy/Portfolio/ExecutionHandler interfaces
+    from live connections.
+
+    One task per connection awaits its messages and hands each one to the data
+    handler and the execution handler, which put MarketEvents and FillEvents on
+    the AsyncEventBus. The bus is then drained right away, with the same handlers
+    as the Backtest, before the next message is read: market data and broker
+    messages are processed as soon as they arrive, whichever comes first, and a
+    strategy never sees a bar newer than the MarketEvent it is handling.
+
+    The signals put while draining are sized together by the Portfolio's
+    generate_orders() once the bus is empty, as in the Backtest.
+
+    The run ends when the market data is over, no event is pending and no order
+    is in flight.
+    """
+    def __init__(self, data_handler, execution_handler, portfolio, strategy, events, connections):
+        """
+        Parameters:
+        data_handler: LiveDataHandler
+        execution_handler: SocketExecutionHandler
+        portfolio: Portfolio
+        strategy: Strategy
+        events: AsyncEventBus shared by the components
+        connections: BrokerConnections to read from (market data and broker, or one for both)
+        """
+        self.data_handler = data_handler
+        self.execution_handler = execution_handler
+        self.portfolio = portfolio
+        self.strategy = strategy
+        self.events = events
+        self.connections = connections
+        self.portfolio.execution_handler = execution_handler # 下单时扣除未成交的订单
+        if getattr(execution_handler, 'bars', False) is None:
+            execution_handler.bars = data_handler # 订单带上发出时的bar
+
+        self.signals = 0
+        self.orders = 0
+        self.fills = 0
+        self._pending_signals = []
+        self._finished = None
+
+        self.events.register(EventType.MARKET, self._on_market)
+        self.events.register(EventType.SIGNAL, self._on_signal)
+        self.events.register(EventType.ORDER, self._on_order)
+        self.events.register(EventType.FILL, self._on_fill)
+
+    def _on_market(self, event):
+        self.strategy.calculate_signals(event)
+        self.portfolio.update_timeindex(event)
+
+    def _on_signal(self, event):
+        self.signals += 1
+        self._pending_signals.append(event)
+
+    def _on_order(self, event):
+        self.orders += 1
+        self.execution_handler.execute_order(event)
+
+    def _on_fill(self, event):
+        self.fills += 1
+        self.portfolio.update_fill(event)
+
+    def _check_finished(self):
+        if (not self.data_handler.continue_backtest and self.events.empty()
+                and self.execution_handler.in_flight() == 0):
+            self._finished.set()
+
+    async def _read(self, connection):
+        async for msg in connection.messages():
+            self.data_handler.on_message(msg)
+            self.execution_handler.on_message(msg)
+            self.events.dispatch_pending()
+            while self._pending_signals:
+                signals, self._pending_signals = self._pending_signals, []
+                self.portfolio.update_signals(signals)
+                self.events.dispatch_pending()
+            self._check_finished()
+        self._finished.set() # connection lost
+
+    async def run(self, timeout=None):
+        """
+        Runs until the end of the market data and of the orders in flight,
+        or until timeout seconds.
+        """
+        self._finished = asyncio.Event()
+        tasks = [asyncio.create_task(self._read(c)) for c in self.connections]
+        try:
+            await asyncio.wait_for(self._finished.wait(), timeout)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            for c in self.connections:
+                await c.close()
+
+
+class SimulatedBrokerServer(object):
+    """
+    A local broker server for testing live trading: it streams the bars of a
+    HistoricCSVDataHandler over a socket and fills every market order at the
+    adjusted close (the price the Portfolio marks with) of the bar given by the
+    order's datetime, i.e. the bar the client sent it on, like the Backtest does.
+    Orders without a datetime fill at the latest bar sent. Fills are charged
+    with the IB commission schedule.
+    """
+    def __init__(self, bars, host='127.0.0.1', port=0, interval=0.0):
+        """
+        Parameters:
+        bars: HistoricCSVDataHandler with the data to stream
+        host, port: address to listen on, port 0 picks a free port
+        interval: seconds to wait between two bars
+        """
+        self.bars = bars
+        self.host = host
+        self.port = port
+        self.interval = interval
+        self.server = None
+        self._clients = set()
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle_client, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        """
+        Stops listening and waits for the connected clients to disconnect.
+        """
+        self.server.close()
+        await asyncio.gather(*self._clients, return_exceptions=True)
+        await self.server.wait_closed()
+
+    @staticmethod
+    def _send(writer, msg):
+        writer.write((json.dumps(msg) + '\n').encode())
+
+    async def _handle_orders(self, reader, writer, state):
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            order = json.loads(line)
+            self._send(writer, {'type': 'ack', 'order_id': order['order_id']})
+            if order.get('order_type', 'MKT') != 'MKT':
+                self._send(writer, {'type': 'error', 'order_id': order['order_id'],
+                                    'message': 'only market orders are supported'})
+                continue
+            i = state['bar']
+            if 'datetime' in order:
+                i = self.bars.bar_datetimes.get_loc(pd.Timestamp(order['datetime']))
+            j = self.bars.field_index['adj_close']
+            fill = FillEvent(None, order['symbol'], 'SIM', order['quantity'], order['direction'], None)
+            self._send(writer, {
+                'type': 'fill', 'order_id': order['order_id'],
+                'datetime': str(self.bars.bar_datetimes[i]), 'symbol': order['symbol'],
+                'quantity': order['quantity'], 'direction': order['direction'],
+                'price': float(self.bars.symbol_data[order['symbol']][i, j]),
+                'commission': fill.commission,
+            })
+            await writer.drain()
+
+    async def _handle_client(self, reader, writer):
+        task = asyncio.current_task()
+        self._clients.add(task)
+        task.add_done_callback(self._clients.discard)
+        state = {'bar': 0}
+        orders = asyncio.create_task(self._handle_orders(reader, writer, state))
+        fields = [f for f in self.bars.bar_fields if f != 'returns']
+        for i, dt in enumerate(self.bars.bar_datetimes):
+            state['bar'] = i
+            self._send(writer, {
+                'type': 'bar', 'datetime': str(dt),
+                'bars': dict(
+                    (s, dict((f, float(self.bars.symbol_data[s][i, self.bars.field_index[f]])) for f in fields))
+                    for s in self.bars.symbol_list
+                ),
+            })
+            await writer.drain()
+            await asyncio.sleep(self.interval)
+        self._send(writer, {'type': 'end'})
+        await writer.drain()
+        await orders # until the client disconnects
+        writer.close()
@@ -1,3 +1,5 @@
+import math
+
 import numpy as np
 import pandas as pd
 
@@ -10,23 +12,134 @@ def create_sharpe_ratio(returns, periods=252): # FIXME: 修改时间频率
     """
     return np.sqrt(periods) * (np.mean(returns)) / np.std(returns)
 
-def create_drawdowns(pnl):
+def create_drawdowns(pnl, with_dates=False):
     """
     Calculate the largest peak-to-through drawdown of the PnL curve as well as 
     the duration of the drawdown. Requires that the pnl_returns is a Pandas Series.
     Parameters:
     pnl: A pandas Series representing the PnL curve
+    with_dates: also return the (start, trough, recovery) timestamps of the
+    largest drawdown; recovery is None if the curve never gets back to its peak.
     """
-    # set up the Hign Water Mark
-    hwm = [0]
     idx = pnl.index
-    drawdown = pd.Series(index = idx, dtype='float64')
-    duration = pd.Series(index = idx, dtype='float64')
-    
-    # loop over the index range
-    for t in range(1, len(idx)):
-        hwm.append(max(hwm[t-1], pnl[t]))
-        drawdown[t] = (hwm[t]-pnl[t]) / hwm[t]
-        duration[t] = (0 if drawdown[t] == 0 else duration[t-1]+1)
-    return drawdown, drawdown.max(), duration.max()
+    values = np.asarray(pnl, dtype='float64')
+    n = len(values)
+    positions = np.arange(n)
+
+    # set up the Hign Water Mark, starting from 0 and ignoring the first value
+    # (the first equity_curve value is always NaN)
+    hwm = np.fmax.accumulate(np.concatenate([[0.0], values[1:]]))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dd = (hwm - values) / hwm
+    dd[:1] = np.nan
+
+    # duration is the number of bars since the curve was last at its high water mark
+    at_peak = dd == 0
+    at_peak[:1] = True
+    last_peak = np.maximum.accumulate(np.where(at_peak, positions, 0))
+    dur = (positions - last_peak).astype('float64')
+    dur[:1] = np.nan
+
+    drawdown = pd.Series(dd, index=idx)
+    duration = pd.Series(dur, index=idx)
+    if not with_dates:
+        return drawdown, drawdown.max(), duration.max()
+
+    start = trough = recovery = None
+    if n > 1 and not np.all(np.isnan(dd[1:])):
+        t = int(np.nanargmax(dd))
+        trough = idx[t]
+        start = idx[last_peak[t]]
+        after = np.flatnonzero(at_peak[t+1:])
+        if len(after) > 0:
+            recovery = idx[t + 1 + after[0]]
+    return drawdown, drawdown.max(), duration.max(), (start, trough, recovery)
+
+
+class StreamingPerformance(object):
+    """
+    Incremental performance statistics of an equity curve, updated in O(1) per bar.
+
+    Keeps the running mean/variance of the period returns (Welford), the high
+    water mark, the current drawdown and its duration, so the stats of a running
+    backtest can be read at any time without building the equity curve DataFrame.
+    The values agree with create_sharpe_ratio() and create_drawdowns() on the
+    final equity curve. Non-finite totals and returns are skipped, as the
+    pandas reductions of those functions skip NaN.
+    """
+    def __init__(self, periods=252):
+        """
+        Parameters:
+        periods: Daily(252), Hourly(252*6.5)
+        """
+        self.periods = periods
+        self.first_total = None
+        self.last_total = None
+        self.num_returns = 0
+        self.mean_return = 0.0
+        self._m2 = 0.0
+        self.hwm = 0.0
+        self.drawdown = 0.0
+        self.max_drawdown = 0.0
+        self.duration = 0
+        self.max_duration = 0
+
+    def update(self, total):
+        """
+        Adds the portfolio total value of a new bar.
+        """
+        if not math.isfinite(total):
+            return # 一个NaN会让之后所有的统计量都变成NaN
+        if self.last_total is None:
+            self.first_total = total
+        elif self.last_total != 0:
+            ret = total / self.last_total - 1.0
+            self.num_returns += 1
+            delta = ret - self.mean_return
+            self.mean_return += delta / self.num_returns
+            self._m2 += delta * (ret - self.mean_return)
+        self.last_total = total
+
+        if total >= self.hwm:
+            self.hwm = total
+            self.drawdown = 0.0
+            self.duration = 0
+        else:
+            self.drawdown = (self.hwm - total) / self.hwm
+            self.duration += 1
+            self.max_drawdown = max(self.max_drawdown, self.drawdown)
+            self.max_duration = max(self.max_duration, self.duration)
+
+    @property
+    def variance(self):
+        """
+        Population variance of the period returns.
+        """
+        if self.num_returns == 0:
+            return np.nan
+        return self._m2 / self.num_returns
+
+    @property
+    def sharpe_ratio(self):
+        if self.num_returns == 0 or self._m2 == 0:
+            return np.nan
+        return np.sqrt(self.periods) * self.mean_return / np.sqrt(self.variance)
+
+    @property
+    def total_return(self):
+        if self.first_total is None:
+            return np.nan
+        return self.last_total / self.first_total - 1.0
 
+    def stats(self):
+        """
+        Returns the current statistics as a dict.
+        """
+        return {
+            'total_return': self.total_return,
+            'sharpe_ratio': self.sharpe_ratio,
+            'drawdown': self.drawdown,
+            'max_drawdown': self.max_drawdown,
+            'drawdown_duration': self.duration,
+            'max_drawdown_duration': self.max_duration,
+        }
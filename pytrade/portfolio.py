@@ -9,18 +9,39 @@ except ImportError:
 import numpy as np
 import pandas as pd
 
-from .event import FillEvent, OrderEvent
-from .performance import create_sharpe_ratio, create_drawdowns
+from .event import EventType, FillEvent, OrderEvent
+from .performance import create_sharpe_ratio, create_drawdowns, StreamingPerformance
 
 class Portfolio(object):
     """
     The Portfolio class handles hte positions and market value of all instruments at a resolution
     of a "bar".
     
-    The positions DataFrame stores a time-index of the quantity of positions held.
-    The holdings DataFrame stores the cash and total market holdings value of each symbo for a particular
+    The positions ledger stores a time-index of the quantity of positions held.
+    The holdings ledger stores the cash and total market holdings value of each symbo for a particular
     time-idnex, as well as the percentage change in portfolio total across bars.
+
+    Both ledgers are preallocated 2-D float arrays (bars x symbols, the holdings one with extra
+    cash/commission/total columns) whose columns follow the integer ids in self.symbol_ids.
+    update_timeindex() writes one row per bar into them; the equity curve wraps them without copying.
+    The current positions are an integer array in the same order (position_array), and
+    the prices of a bar are fetched at once with bars.get_latest_bars_matrix().
+
+    If fee_schedule (a fees.FeeSchedule) has holding costs, e.g. borrow fees, they are
+    charged on every bar to the positions held, and booked with the commissions.
+
+    If execution_handler is set, orders are sized against the positions plus the
+    orders sent but not filled yet (ExecutionHandler.pending_quantities(), of
+    strategy_id only if set), so a signal arriving before the fill of an earlier
+    order neither repeats nor misses it.
+
+    When pickled (see pytrade.checkpoint), only the rows written so far of the
+    ledgers are kept; the capacity is allocated again when unpickled.
     """
+    fee_schedule = None
+    execution_handler = None
+    strategy_id = None
+
     def __init__(self, bars, events, start_date, initial_capital = 100000.0):
         """
         Initialises the portfolio with bars and an event queue.
@@ -38,35 +59,96 @@ class Portfolio(object):
         self.bars = bars
         self.events = events
         self.symbol_list = self.bars.symbol_list
+        self.symbol_ids = dict((s, i) for i, s in enumerate(self.symbol_list))
         self.start_date = start_date
         self.initial_capital = initial_capital
+
+        # 行数: 起始行 + 每个bar一行 + 最后重复的一行; 不知道bar数时按需扩容
+        bar_datetimes = getattr(self.bars, 'bar_datetimes', None)
+        self.ledger_capacity = len(bar_datetimes) + 2 if bar_datetimes is not None else 1024
+        self.ledger_datetimes = [self.start_date]
+        self.num_rows = 1
         
-        self.all_positions = self.construct_all_positions()
-        self.current_positions = dict( (k,v) for k,v in [(s,0) for s in self.symbol_list])
+        self.position_ledger = self.construct_all_positions()
+        self.position_array = np.zeros(len(self.symbol_list), dtype=np.int64) # 按symbol_ids索引
         
-        self.all_holdings = self.construct_all_holdings()
+        self.holdings_ledger = self.construct_all_holdings()
         self.current_holdings = self.construct_current_holdings()
+
+        # Running stats of the holdings total, readable at any time during the run
+        self.performance = StreamingPerformance(periods=252) #FIXME: 修改时间频率
+        self.performance.update(self.initial_capital)
         
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['position_ledger'] = self.position_ledger[:self.num_rows].copy()
+        state['holdings_ledger'] = self.holdings_ledger[:self.num_rows].copy()
+        return state
+
+    def __setstate__(self, state):
+        positions = state.pop('current_positions', None)
+        if positions is not None: # 旧的快照里仓位是dict
+            state['position_array'] = np.array([positions[s] for s in state['symbol_list']], dtype=np.int64)
+        self.__dict__.update(state)
+        for name in ('position_ledger', 'holdings_ledger'):
+            rows = getattr(self, name)
+            ledger = np.zeros((self.ledger_capacity, rows.shape[1]))
+            ledger[:self.num_rows] = rows
+            setattr(self, name, ledger)
+
     def construct_all_positions(self):
         """
-        constructs the positions list using the start_date
+        constructs the positions ledger using the start_date
         to determine when the time index will begin.
         """
-        d = dict( (k,v) for k,v in [(s,0) for s in self.symbol_list])
-        d['datetime'] = self.start_date
-        return [d]
+        return np.zeros((self.ledger_capacity, len(self.symbol_list)))
     
     def construct_all_holdings(self):
         """
-        Constructs the holdings list using the start_date
+        Constructs the holdings ledger using the start_date
         to determine when the time index will begin.
+        Columns are the symbols followed by cash, commission and total.
         """
-        d = dict( (k,v)  for k,v in [(s,0) for s in self.symbol_list])
-        d['datetime'] = self.start_date
-        d['cash'] = self.initial_capital
-        d['commission'] = 0.0
-        d['total'] = self.initial_capital
-        return [d]
+        n = len(self.symbol_list)
+        ledger = np.zeros((self.ledger_capacity, n + 3))
+        ledger[0, n] = self.initial_capital # cash
+        ledger[0, n + 2] = self.initial_capital # total
+        return ledger
+
+    def _grow_ledgers(self):
+        """
+        Doubles the capacity of both ledgers.
+        """
+        self.ledger_capacity *= 2
+        for name in ('position_ledger', 'holdings_ledger'):
+            old = getattr(self, name)
+            new = np.zeros((self.ledger_capacity, old.shape[1]))
+            new[:self.num_rows] = old[:self.num_rows]
+            setattr(self, name, new)
+
+    @property
+    def current_positions(self):
+        """
+        The current positions as a symbol -> quantity dict (a copy of position_array).
+        """
+        return dict(zip(self.symbol_list, self.position_array.tolist()))
+
+    @property
+    def all_positions(self):
+        """
+        The positions history as a list of dicts, one per bar.
+        """
+        return [dict(zip(self.symbol_list, row), datetime=dt)
+                for dt, row in zip(self.ledger_datetimes, self.position_ledger[:self.num_rows].tolist())]
+
+    @property
+    def all_holdings(self):
+        """
+        The holdings history as a list of dicts, one per bar.
+        """
+        columns = self.symbol_list + ['cash', 'commission', 'total']
+        return [dict(zip(columns, row), datetime=dt)
+                for dt, row in zip(self.ledger_datetimes, self.holdings_ledger[:self.num_rows].tolist())]
         
     def construct_current_holdings(self):
         """
@@ -87,34 +169,35 @@ class Portfolio(object):
         Makes use of a MarketEvent from the events queue.
         """
         latest_datetime = self.bars.get_latest_bar_datetime(self.symbol_list[0])
+        if self.num_rows == self.ledger_capacity:
+            self._grow_ledgers()
+        i = self.num_rows
+        n = len(self.symbol_list)
         
         # update positions
         # =================
-        dp = dict( (k,v) for k,v in [(s,0) for s in self.symbol_list])
-        dp['datetime'] = latest_datetime
-        
-        for s in self.symbol_list:
-            dp[s] = self.current_positions[s]
-        # Append the current positions
-        self.all_positions.append(dp)
+        positions = self.position_ledger[i]
+        positions[:] = self.position_array
         
         # Update holdings
         # ================
-        dh = dict( (k,v) for k,v in [(s,0) for s in self.symbol_list])
-        dh['datetime'] = latest_datetime
-        dh['cash'] = self.current_holdings['cash']
-        dh['commission'] = self.current_holdings['commission']
-        dh['total'] = self.current_holdings['cash']
-        
-        for s in self.symbol_list:
-            # Approximation to the real value
-            market_value = self.current_positions[s] * self.bars.get_latest_bar_value(s, 'adj_close')
-        
-            dh[s] = market_value
-            dh['total'] += market_value
-            
-        # Append the current holdings
-        self.all_holdings.append(dh)
+        # Approximation to the real value
+        prices = self.bars.get_latest_bars_matrix('adj_close', 1)[-1]
+        if self.fee_schedule is not None and self.fee_schedule.has_holding_cost:
+            fee = float(np.sum(self.fee_schedule.holding_cost(positions, prices)))
+            self.current_holdings['commission'] += fee
+            self.current_holdings['cash'] -= fee
+            self.current_holdings['total'] -= fee
+        dh = self.holdings_ledger[i]
+        np.multiply(positions, prices, out=dh[:n])
+        np.copyto(dh[:n], 0.0, where=positions == 0) # 未上市的symbol价格为NaN, 没有仓位时市值为0
+        dh[n] = self.current_holdings['cash']
+        dh[n + 1] = self.current_holdings['commission']
+        dh[n + 2] = dh[n] + dh[:n].sum()
+
+        self.ledger_datetimes.append(latest_datetime)
+        self.num_rows += 1
+        self.performance.update(dh[n + 2])
         
     def update_positions_from_fill(self, fill):
         """
@@ -132,7 +215,7 @@ class Portfolio(object):
             fill_dir = -1
         
         # Update positions list with new quantities
-        self.current_positions[fill.symbol] += fill_dir*fill.quantity
+        self.position_array[self.symbol_ids[fill.symbol]] += fill_dir*fill.quantity
     
     def update_holdings_from_fill(self, fill):
         """
@@ -150,7 +233,9 @@ class Portfolio(object):
             fill_dir = -1
             
         # Update holdings list with new quantities
-        fill_cost = self.bars.get_latest_bar_value(fill.symbol, "adj_close")
+        fill_cost = fill.fill_cost
+        if fill_cost is None:
+            fill_cost = self.bars.get_latest_bar_value(fill.symbol, "adj_close")
         cost = fill_dir * fill_cost * fill.quantity
         self.current_holdings[fill.symbol] += cost
         self.current_holdings['commission'] += fill.commission
@@ -162,17 +247,29 @@ class Portfolio(object):
         Updates the portfolio current positions and holdings
         from a FillEvent
         """
-        if event.type == 'FILL':
+        if event.type == EventType.FILL:
             self.update_positions_from_fill(event)
             self.update_holdings_from_fill(event)
             
-    def generate_naive_order(self, signal):
+    def get_pending_quantities(self):
+        """
+        Returns symbol -> signed quantity of the orders not filled yet, empty
+        without an execution_handler.
+        """
+        if self.execution_handler is None:
+            return {}
+        return self.execution_handler.pending_quantities(self.strategy_id)
+
+    def generate_naive_order(self, signal, pending=None):
         """
         Simple files on Order object as a constant quantity sizing of the signal object, without risk management or position sizing considerations.
         
         Parameters:
         signal: The tuple containing Signal information
+        pending: get_pending_quantities(), computed if None
         """
+        if pending is None:
+            pending = self.get_pending_quantities()
         order = None
         
         symbol = signal.symbol
@@ -180,7 +277,7 @@ class Portfolio(object):
         strength = signal.strength
         
         mkt_quantity = 100
-        cur_quantity = self.current_positions[symbol]
+        cur_quantity = int(self.position_array[self.symbol_ids[symbol]]) + pending.get(symbol, 0) # 包括未成交的订单
         order_type = 'MKT'
         
         if direction == 'LONG' and cur_quantity == 0:
@@ -194,28 +291,121 @@ class Portfolio(object):
             order = OrderEvent(symbol, order_type, abs(cur_quantity), 'BUY')
         return order
     
+    def get_total_equity(self):
+        """
+        Returns cash plus the market value of all positions at the latest prices.
+        """
+        held = self.position_array != 0
+        prices = self.bars.get_latest_bars_matrix('adj_close', 1)[-1]
+        return self.current_holdings['cash'] + float(np.dot(self.position_array[held], prices[held]))
+
+    def generate_target_order(self, signal, equity=None, pending=None):
+        """
+        Files an Order object that takes the position of the signal's symbol to
+        the signal's target_quantity, or to target_weight of the portfolio equity
+        (truncated to whole shares). Returns None if the position is already there.
+
+        Parameters:
+        signal: a SignalEvent with target_quantity or target_weight set
+        equity: the portfolio equity to size target_weight with, computed if None
+        pending: get_pending_quantities(), computed if None
+        """
+        if pending is None:
+            pending = self.get_pending_quantities()
+        symbol = signal.symbol
+        if signal.target_quantity is not None:
+            target = int(signal.target_quantity)
+        else:
+            if equity is None:
+                equity = self.get_total_equity()
+            price = self.bars.get_latest_bar_value(symbol, 'adj_close')
+            target = int(signal.target_weight * equity / price)
+
+        delta = target - int(self.position_array[self.symbol_ids[symbol]]) - pending.get(symbol, 0)
+        if delta > 0:
+            return OrderEvent(symbol, 'MKT', delta, 'BUY')
+        if delta < 0:
+            return OrderEvent(symbol, 'MKT', -delta, 'SELL')
+        return None
+
+    def generate_order(self, signal, equity=None, pending=None):
+        """
+        Sizes a target signal with generate_target_order(), and any other signal
+        with generate_naive_order(). The order carries the signal's strategy_id.
+        """
+        if signal.target_quantity is not None or signal.target_weight is not None:
+            order = self.generate_target_order(signal, equity, pending)
+        else:
+            order = self.generate_naive_order(signal, pending)
+        if order is not None:
+            order.strategy_id = signal.strategy_id
+        return order
+
+    def generate_orders(self, signals):
+        """
+        Batched order generation for a rebalance: returns at most one OrderEvent per
+        symbol, the later signals of a symbol replacing the earlier ones. Target
+        weights are all sized against the same equity, computed once.
+
+        Parameters:
+        signals: iterable of SignalEvents
+        """
+        latest = {}
+        for signal in signals:
+            latest[signal.symbol] = signal
+        equity = None
+        if any(sig.target_weight is not None for sig in latest.values()):
+            equity = self.get_total_equity()
+        pending = self.get_pending_quantities()
+        orders = [self.generate_order(sig, equity, pending) for sig in latest.values()]
+        return [order for order in orders if order is not None]
+
     def update_signal(self, event):
         """
         Acts on a SignalEvent to generate new orders
         based on the portfolio logic
         """
-        if event.type == 'SIGNAL':
-            order_event = self.generate_naive_order(event)
-            self.events.put(order_event)  #MARK: 放入信号事件 
+        if event.type == EventType.SIGNAL:
+            order_event = self.generate_order(event)
+            if order_event is not None:
+                self.events.put(order_event)  #MARK: 放入信号事件 
+
+    def update_signals(self, signals):
+        """
+        Acts on the SignalEvents of one bar at once: sizes them with
+        generate_orders() and puts the orders on the queue.
+        """
+        for order_event in self.generate_orders(signals):
+            self.events.put(order_event)
+
+    def get_current_stats(self):
+        """
+        Returns the running performance statistics as of the last bar,
+        without building the equity curve. Useful for live monitoring or
+        for stopping bad runs early.
+        """
+        return self.performance.stats()
 
     def create_equity_curve_dataframe(self):
         """
-        Creates a Pandas DataFrame from all_holdings list of dictionaries.
+        Creates a Pandas DataFrame on top of the holdings ledger.
         """
-        curve = pd.DataFrame(self.all_holdings)
-        curve.set_index('datetime', inplace = True)
+        curve = pd.DataFrame(
+            self.holdings_ledger[:self.num_rows],
+            index=pd.Index(self.ledger_datetimes, name='datetime'),
+            columns=self.symbol_list + ['cash', 'commission', 'total'],
+            copy=False
+        )
         curve['returns'] = curve['total'].pct_change()
         curve['equity_curve'] = (1+curve['returns']).cumprod()
         self.equity_curve = curve
         
-    def output_summary_stats(self):
+    def output_summary_stats(self, filename='equity.csv'):
         """
         Create a list of summary statsitics for the portfolio.
+
+        Parameters:
+        filename: where to save the equity curve, None to skip saving.
         """
         total_return = self.equity_curve['equity_curve'][-1]
         returns = self.equity_curve['returns']
@@ -229,7 +419,8 @@ class Portfolio(object):
                  ("Sharpe Ratio", "%0.2f" % sharpe_ratio), 
                  ("Max Drawdown", "%0.2f%%" % (max_dd * 100.0)), 
                  ("Drawdown Duration", "%d" % dd_duration)]
-        self.equity_curve.to_csv('equity.csv')
+        if filename is not None:
+            self.equity_curve.to_csv(filename)
         return stats
     
     
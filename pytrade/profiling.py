@@ -0,0 +1,171 @@
+from array import array
+from collections import OrderedDict
+import contextlib
+import io
+import time
+
+import numpy as np
+import pandas as pd
+
+# 回测的性能分析: 只在打开时才包装handler和组件的方法, 关闭时热路径上没有任何额外代码.
+
+
+class Instrumentation(object):
+    """
+    Collects timings of a Backtest run:
+
+    - per event type: count, total time and p50/p99 latency of the handlers;
+    - per component method: update_bars, calculate_signals, update_timeindex, update_fill;
+    - the peak depth of the event queue within each bar.
+
+    The Backtest wraps its handlers and the component methods with wrap() when
+    an Instrumentation is given, so nothing is added to the loop otherwise.
+    Optionally, the run is also captured by cProfile or pyinstrument.
+
+    Parameters:
+    profiler: None, 'cprofile' or 'pyinstrument' (which must be installed)
+    """
+    def __init__(self, profiler=None):
+        if profiler not in (None, 'cprofile', 'pyinstrument'):
+            raise ValueError(f"Unknown profiler {profiler}, expected 'cprofile' or 'pyinstrument'")
+        self.profiler = profiler
+        self.timings = OrderedDict() # (group, name) -> array of seconds
+        self.queue_depths = array('l')
+        self.profile = None # pstats.Stats or pyinstrument Session after the run
+        self._pyinstrument = None
+        self.wall_time = 0.0
+        self._peak = 0
+        self._in_bar = False
+
+    def wrap(self, group, name, func):
+        """
+        Returns func timed under (group, name).
+        """
+        durations = self.timings.setdefault((group, name), array('d'))
+        record = durations.append
+        clock = time.perf_counter
+
+        def timed(*args, **kwargs):
+            start = clock()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record(clock() - start)
+        return timed
+
+    def wrap_handler(self, event_type, handler, events):
+        """
+        Returns an event handler timed under its event type, which also records
+        the depth of the event queue after it ran.
+        """
+        timed = self.wrap('event', event_type.value if hasattr(event_type, 'value') else str(event_type), handler)
+
+        def handle(event):
+            timed(event)
+            depth = len(events)
+            if depth > self._peak:
+                self._peak = depth
+        return handle
+
+    def new_bar(self):
+        """
+        Called at the start of every bar: closes the queue depth of the previous one.
+        """
+        if self._in_bar:
+            self.queue_depths.append(self._peak)
+        self._in_bar = True
+        self._peak = 0
+
+    @contextlib.contextmanager
+    def run(self):
+        """
+        Context manager around the backtest loop: measures the wall time and
+        runs the profiler, if any.
+        """
+        profiler = None
+        if self.profiler == 'cprofile':
+            import cProfile
+            profiler = cProfile.Profile()
+            profiler.enable()
+        elif self.profiler == 'pyinstrument':
+            import pyinstrument
+            profiler = pyinstrument.Profiler()
+            profiler.start()
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.wall_time += time.perf_counter() - start
+            if self._in_bar:
+                self.queue_depths.append(self._peak)
+                self._in_bar = False
+            if self.profiler == 'cprofile':
+                import pstats
+                profiler.disable()
+                self.profile = pstats.Stats(profiler, stream=io.StringIO())
+            elif self.profiler == 'pyinstrument':
+                profiler.stop()
+                self.profile = profiler.last_session
+                self._pyinstrument = profiler
+
+    def report(self):
+        """
+        Returns the collected statistics as a dict:
+
+        {'wall_time': seconds,
+         'event': {type: {'count', 'total', 'mean', 'p50', 'p99'}},  times in seconds
+         'component': {method: {...}},
+         'queue_depth': {'bars', 'mean', 'p99', 'max'}}
+        """
+        result = {'wall_time': self.wall_time, 'event': OrderedDict(), 'component': OrderedDict()}
+        for (group, name), durations in self.timings.items():
+            values = np.frombuffer(durations, dtype='float64') if len(durations) else np.zeros(0)
+            result[group][name] = {
+                'count': len(values),
+                'total': float(values.sum()),
+                'mean': float(values.mean()) if len(values) else np.nan,
+                'p50': float(np.percentile(values, 50)) if len(values) else np.nan,
+                'p99': float(np.percentile(values, 99)) if len(values) else np.nan,
+            }
+        depths = np.frombuffer(self.queue_depths, dtype=np.dtype('l')) if len(self.queue_depths) else np.zeros(0)
+        result['queue_depth'] = {
+            'bars': len(depths),
+            'mean': float(depths.mean()) if len(depths) else np.nan,
+            'p99': float(np.percentile(depths, 99)) if len(depths) else np.nan,
+            'max': int(depths.max()) if len(depths) else 0,
+        }
+        return result
+
+    def to_frame(self):
+        """
+        Returns the event and component timings as a DataFrame, times in microseconds.
+        """
+        report = self.report()
+        rows = []
+        for group in ('event', 'component'):
+            for name, stats in report[group].items():
+                rows.append((group, name, stats['count'], stats['total'] * 1e6, stats['mean'] * 1e6,
+                             stats['p50'] * 1e6, stats['p99'] * 1e6))
+        return pd.DataFrame(
+            rows, columns=['group', 'name', 'count', 'total_us', 'mean_us', 'p50_us', 'p99_us']
+        ).set_index(['group', 'name'])
+
+    def format_report(self, top=20):
+        """
+        Returns the report as text, followed by the top functions of the profiler if any.
+        """
+        report = self.report()
+        depth = report['queue_depth']
+        lines = [
+            f"Wall time: {report['wall_time']:.3f}s",
+            self.to_frame().to_string(float_format=lambda x: f"{x:.1f}"),
+            f"Queue depth per bar: mean {depth['mean']:.2f}, p99 {depth['p99']:.0f}, max {depth['max']}",
+        ]
+        if self.profiler == 'cprofile' and self.profile is not None:
+            stream = io.StringIO()
+            self.profile.stream = stream
+            self.profile.sort_stats('cumulative').print_stats(top)
+            lines.append(stream.getvalue())
+        elif self.profiler == 'pyinstrument' and self.profile is not None:
+            lines.append(self._pyinstrument.output_text())
+        return '\n'.join(lines)
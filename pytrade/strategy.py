@@ -9,7 +9,7 @@ except ImportError:
 import numpy as np
 import pandas as pd
 
-from .event import SignalEvent
+from .event import EventType, SignalEvent
 
 class Strategy(object):
     """
@@ -18,6 +18,9 @@ class Strategy(object):
     Bars generated by a DataHandler object.
     """
     __metaclass__ = ABCMeta
+
+    # Put on the signals; the Backtest sets it when it runs several strategies
+    strategy_id = 1
     
     @abstractmethod
     def calculate_signals(self):
@@ -30,4 +33,91 @@ class Strategy(object):
     def order_target(self):
         raise NotImplementedError("Should implement order_target()")
 
-    
\ No newline at end of file
+
+class VectorizedStrategy(object):
+    """
+    VectorizedStrategy is an abstract base class for strategies run by the
+    VectorizedBacktest. Instead of reacting to MarketEvents bar by bar, it sees the
+    whole price panel at once and returns the target positions for every bar.
+    """
+    __metaclass__ = ABCMeta
+
+    @abstractmethod
+    def generate_target_positions(self, prices):
+        """
+        Returns a (dates x symbols) DataFrame of target quantities (signed number
+        of shares) with the same index and columns as `prices`.
+
+        Row t may only use prices up to and including row t; the target is
+        filled at the close of bar t, like a signal in the event-driven engine.
+
+        Parameters:
+        prices: (dates x symbols) DataFrame of adj_close prices
+        """
+        raise NotImplementedError("Should implement generate_target_positions()")
+
+
+class CrossSectionalStrategy(Strategy):
+    """
+    CrossSectionalStrategy is an abstract base class for strategies that work on
+    the whole universe at once. On every MarketEvent, calculate_targets() gets the
+    (window x symbols) price matrix in one call and returns one target per symbol;
+    TARGET SignalEvents are only sent for the symbols whose target changed.
+
+    Subclasses set target_kind to 'quantity' to return numbers of shares instead
+    of portfolio weights.
+    """
+    __metaclass__ = ABCMeta
+
+    target_kind = 'weight'
+
+    def __init__(self, bars, account, events, window=1, field='adj_close', strategy_id=1):
+        """
+        Parameters:
+        bars: DataHandler object
+        account: Portfolio object
+        events: The event Queue object
+        window: number of bars in the price matrix
+        field: bar field of the price matrix
+        strategy_id: recorded on the signals
+        """
+        self.bars = bars
+        self.account = account
+        self.events = events
+        self.symbol_list = self.bars.symbol_list
+        self.window = window
+        self.field = field
+        self.strategy_id = strategy_id
+        self.targets = np.zeros(len(self.symbol_list))
+
+    @abstractmethod
+    def calculate_targets(self, prices):
+        """
+        Returns an array of one target per symbol, in symbol_list order. NaN keeps
+        the current target of a symbol.
+
+        Parameters:
+        prices: (window x symbols) array of the latest bars, fewer rows at the start
+        """
+        raise NotImplementedError("Should implement calculate_targets()")
+
+    def calculate_signals(self, event):
+        if event.type == EventType.MARKET:
+            prices = self.bars.get_latest_bars_matrix(self.field, N=self.window)
+            if len(prices) == 0:
+                return
+            targets = np.asarray(self.calculate_targets(prices), dtype='float64')
+            # 只对目标发生变化的symbol发信号
+            changed = np.flatnonzero((targets == targets) & (targets != self.targets))
+            if len(changed) == 0:
+                return
+            self.targets[changed] = targets[changed]
+            bar_date = self.bars.get_latest_bar_datetime(self.symbol_list[0])
+            for i in changed:
+                if self.target_kind == 'quantity':
+                    signal = SignalEvent(self.strategy_id, self.symbol_list[i], bar_date, 'TARGET', 1.0,
+                                         target_quantity=int(targets[i]))
+                else:
+                    signal = SignalEvent(self.strategy_id, self.symbol_list[i], bar_date, 'TARGET', 1.0,
+                                         target_weight=float(targets[i]))
+                self.events.put(signal)
@@ -0,0 +1,172 @@
+import contextlib
+import io
+import itertools
+import multiprocessing
+import os
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+from .backtest import Backtest
+from .datahandler import HistoricCSVDataHandler
+
+# 每个worker进程里的共享行情, 由_init_worker设置
+_worker_bars = {}
+
+
+class SharedBarsDataHandler(HistoricCSVDataHandler):
+    """
+    A HistoricCSVDataHandler that does not read any CSV: its bar arrays are
+    read-only views into the shared memory block set up by ParameterSweep.
+    Only usable inside a sweep worker.
+    """
+    def _open_convert_csv_files(self):
+        """
+        Attaches the bar arrays of the worker's shared memory block.
+        """
+        block = _worker_bars['block']
+        for i, s in enumerate(_worker_bars['symbol_list']):
+            # block[i] is (fields x bars) C-order, its transpose is the usual (bars x fields) F-order array
+            self.symbol_data[s] = block[i].T
+        self.bar_datetimes = _worker_bars['bar_datetimes']
+
+
+def _init_worker(shm_name, shape, symbol_list, bar_datetimes, warmup=None):
+    """
+    Pool initializer: attaches the shared memory block once per worker.
+    """
+    shm = shared_memory.SharedMemory(name=shm_name)
+    block = np.ndarray(shape, dtype='float64', buffer=shm.buf)
+    block.flags.writeable = False
+    _worker_bars['shm'] = shm # keep the mapping alive
+    _worker_bars['block'] = block
+    _worker_bars['symbol_list'] = symbol_list
+    _worker_bars['bar_datetimes'] = bar_datetimes
+    _worker_bars['warmup'] = warmup # bytes of the warm-up checkpoint, or None
+
+
+def _run_one(args):
+    """
+    Runs one backtest of the grid and returns its params and summary stats.
+    """
+    settings, params = args
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        if _worker_bars['warmup'] is not None:
+            backtest = Backtest.load_checkpoint(io.BytesIO(_worker_bars['warmup']), data_handler=SharedBarsDataHandler)
+            backtest.execution_handler_cls = settings['execution_handler']
+            backtest.portfolio_cls = settings['portfolio']
+            backtest._fork(settings['strategy'], params)
+        else:
+            backtest = Backtest(
+                settings['csv_dir'], settings['symbol_list'], settings['initial_capital'],
+                0.0, settings['start_date'], settings['end_date'],
+                SharedBarsDataHandler, settings['execution_handler'],
+                settings['portfolio'], settings['strategy'], strategy_params=params
+            )
+        backtest._run_backtest()
+        backtest.portfolio.create_equity_curve_dataframe()
+        stats = backtest.portfolio.output_summary_stats(filename=None)
+    row = dict(params)
+    row.update(stats)
+    row['Signals'] = backtest.signals
+    row['Orders'] = backtest.orders
+    row['Fills'] = backtest.fills
+    return row
+
+
+class ParameterSweep(object):
+    """
+    Runs one Backtest per point of a parameter grid across a process pool.
+
+    The market data is parsed once in the parent process with a
+    HistoricCSVDataHandler and copied into a single shared memory block;
+    workers map it read-only instead of re-reading the CSV files.
+
+    With a warm-up checkpoint (see Backtest.save_checkpoint()), every point of
+    the grid is forked from it instead of starting at the first bar: only the
+    rest of the data is run, with the indicators already warmed up.
+    """
+    def __init__(self, csv_dir, symbol_list, initial_capital,
+                 start_date, end_date, execution_handler, portfolio, strategy,
+                 param_grid, n_workers=None, warmup=None):
+        """
+        Parameters
+        ----------
+        csv_dir : The hard root to the CSV data directory.
+        symbol_list : list of symbols
+        initial_capital : starting cash
+        start_date, end_date : date range of the backtest
+        execution_handler : ExecutionHandler Class
+        portfolio : Portfolio Class
+        strategy : Strategy Class, must be importable by the workers
+        param_grid : dict of parameter name -> list of values, e.g.
+            {'short_window': [20, 50], 'long_window': [100, 200]},
+            or a list of parameter dicts
+        n_workers : number of processes, defaults to os.cpu_count()
+        warmup : path of a checkpoint of a Backtest over the same csv_dir, symbols
+            and dates, to fork every run from (its execution handler and
+            portfolio classes are replaced by the ones given here)
+        """
+        self.csv_dir = csv_dir
+        self.symbol_list = symbol_list
+        self.initial_capital = initial_capital
+        self.start_date = start_date
+        self.end_date = end_date
+        self.execution_handler_cls = execution_handler
+        self.portfolio_cls = portfolio
+        self.strategy_cls = strategy
+        self.param_grid = param_grid
+        self.n_workers = n_workers or os.cpu_count()
+        self.warmup = warmup
+
+    def _expand_grid(self):
+        """
+        Returns the list of parameter dicts to run.
+        """
+        if isinstance(self.param_grid, dict):
+            keys = list(self.param_grid)
+            return [dict(zip(keys, values))
+                    for values in itertools.product(*[self.param_grid[k] for k in keys])]
+        return list(self.param_grid)
+
+    def run(self):
+        """
+        Runs the sweep and returns a DataFrame with one row per parameter set:
+        the parameters, the output_summary_stats() entries and the event counts.
+        """
+        grid = self._expand_grid()
+        warmup = None
+        if self.warmup is not None:
+            with open(self.warmup, 'rb') as f:
+                warmup = f.read()
+        bars = HistoricCSVDataHandler(None, self.csv_dir, self.symbol_list, self.start_date, self.end_date)
+        shape = (len(self.symbol_list), len(bars.bar_fields), len(bars.bar_datetimes))
+
+        shm = shared_memory.SharedMemory(create=True, size=max(int(np.prod(shape)) * 8, 1))
+        try:
+            block = np.ndarray(shape, dtype='float64', buffer=shm.buf)
+            for i, s in enumerate(self.symbol_list):
+                block[i] = bars.symbol_data[s].T
+            del block
+
+            settings = {
+                'csv_dir': self.csv_dir,
+                'symbol_list': self.symbol_list,
+                'initial_capital': self.initial_capital,
+                'start_date': self.start_date,
+                'end_date': self.end_date,
+                'execution_handler': self.execution_handler_cls,
+                'portfolio': self.portfolio_cls,
+                'strategy': self.strategy_cls,
+            }
+            chunksize = max(1, len(grid) // (self.n_workers * 4))
+            with multiprocessing.Pool(
+                self.n_workers, initializer=_init_worker,
+                initargs=(shm.name, shape, self.symbol_list, bars.bar_datetimes, warmup)
+            ) as pool:
+                rows = pool.map(_run_one, [(settings, p) for p in grid], chunksize=chunksize)
+        finally:
+            shm.close()
+            shm.unlink()
+        return pd.DataFrame(rows)
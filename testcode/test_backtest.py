@@ -0,0 +1,56 @@
+import contextlib
+import io
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pytrade.backtest import Backtest
+from pytrade.datahandler import HistoricCSVDataHandler
+from pytrade.event import FillEvent, SignalEvent
+from pytrade.execution import ExecutionHandler
+from pytrade.portfolio import Portfolio
+from pytrade.strategy import Strategy
+
+CSV_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data')
+
+
+class BuyOnceStrategy(Strategy):
+    """
+    Goes long on the first bar and holds.
+    """
+    def __init__(self, bars, account, events):
+        self.bars = bars
+        self.events = events
+        self.bought = False
+
+    def calculate_signals(self, event):
+        if not self.bought:
+            self.bought = True
+            self.events.put(SignalEvent(self.strategy_id, 'AAPL', self.bars.get_latest_bar_datetime('AAPL'), 'LONG', 1.0))
+
+    def order_target(self):
+        pass
+
+
+class RoutedExecutionHandler(ExecutionHandler):
+    """
+    An execution handler with the constructor of IBexecutionHandler, which takes no clock.
+    """
+    def __init__(self, events, order_routing="SMART", currency="USD"):
+        self.events = events
+        self.order_routing = order_routing
+        self.currency = currency
+
+    def execute_order(self, event):
+        self.events.put(FillEvent(self.clock.now(), event.symbol, self.order_routing,
+                                  event.quantity, event.direction, None))
+
+
+def test_execution_handler_without_clock_argument():
+    with contextlib.redirect_stdout(io.StringIO()):
+        backtest = Backtest(CSV_DIR, ['AAPL'], 100000.0, 0.0, None, None, HistoricCSVDataHandler,
+                            RoutedExecutionHandler, Portfolio, BuyOnceStrategy)
+        backtest._run_backtest()
+    assert backtest.execution_handler.clock is backtest.clock
+    assert backtest.execution_handler.order_routing == 'SMART'
+    assert backtest.fills == backtest.orders == 1
@@ -30,9 +30,9 @@ if __name__ == "__main__":
     dir(aa)
     aa.symbol_list
     aa.symbol_data
-    aa.latest_symbol_data 
+    aa.bar_index
     aa.update_bars()
-    aa.latest_symbol_data['AAPL'][0][1]
+    aa.get_latest_bar('AAPL')[1]
     aa.get_latest_bar_value('AAPL', 'close')
     aa.get_latest_bars_values('AAPL', 'close', N=50) # array
     aa.get_latest_bars('AAPL', N=2) # 
@@ -0,0 +1,25 @@
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from pytrade.event import FillEvent, calculate_ib_commission
+
+
+def test_ib_commission_scalar_matches_array():
+    # 标量与数组两条路径逐个元素比较, 包括0
+    quantities = np.array([0, 1, 50, 99, 100, 101, 499, 500, 501, 1000, 10000, -1, -100, -600])
+    expected = calculate_ib_commission(quantities)
+    assert expected[0] == 0.0
+    for q, fee in zip(quantities, expected):
+        assert calculate_ib_commission(int(q)) == fee
+        assert calculate_ib_commission(float(q)) == fee
+        assert calculate_ib_commission(q) == fee
+        assert calculate_ib_commission(np.array(q)) == fee
+    assert np.array_equal(calculate_ib_commission(quantities.reshape(2, 7)), expected.reshape(2, 7))
+
+
+def test_fill_event_commission():
+    assert FillEvent(None, 'AAPL', 'ARCA', 100, 'BUY', 10.0).commission == 1.3
+    assert FillEvent(None, 'AAPL', 'ARCA', 1000, 'BUY', 10.0).commission == 8.0
@@ -0,0 +1,74 @@
+from datetime import datetime
+import asyncio
+import contextlib
+import io
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'examples'))
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from mac import MovingAverageCrossStrategy
+from pytrade.backtest import Backtest
+from pytrade.datahandler import HistoricCSVDataHandler
+from pytrade.eventbus import AsyncEventBus, DequeEventBus
+from pytrade.execution import SimulatedExecutionHandler
+from pytrade.live import BrokerConnection, LiveDataHandler, LiveTradingEngine, SimulatedBrokerServer, SocketExecutionHandler
+from pytrade.portfolio import Portfolio
+
+CSV_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data')
+START, END = datetime(1999, 11, 1), datetime(2008, 12, 31)
+
+
+def run_backtest(params):
+    with contextlib.redirect_stdout(io.StringIO()):
+        backtest = Backtest(CSV_DIR, ['AAPL'], 100000.0, 0.0, START, END, HistoricCSVDataHandler,
+                            SimulatedExecutionHandler, Portfolio, MovingAverageCrossStrategy, strategy_params=params)
+        backtest._run_backtest()
+    return backtest.signals, backtest.orders, backtest.portfolio.current_holdings['total']
+
+
+async def run_live(params):
+    server = await SimulatedBrokerServer(
+        HistoricCSVDataHandler(DequeEventBus(), CSV_DIR, ['AAPL'], START, END), interval=0.0
+    ).start()
+    events = AsyncEventBus()
+    connection = await BrokerConnection('127.0.0.1', server.port).connect()
+    bars = LiveDataHandler(events, ['AAPL'], max_bars=500, lookback=300)
+    portfolio = Portfolio(bars, events, START, 100000.0)
+    engine = LiveTradingEngine(bars, SocketExecutionHandler(events, connection), portfolio,
+                               MovingAverageCrossStrategy(bars, portfolio, events, **params), events, [connection])
+    with contextlib.redirect_stdout(io.StringIO()):
+        await engine.run(timeout=60)
+    await server.stop()
+    return engine.signals, engine.orders, portfolio.current_holdings['total']
+
+
+@pytest.mark.parametrize('params', [{'short_window': 50, 'long_window': 200}, {'short_window': 5, 'long_window': 20}])
+def test_live_orders_match_backtest(params):
+    # bar推送得比成交回报快时, 未成交的订单也要计入仓位, 订单数与回测一致
+    signals, orders, total = asyncio.run(run_live(params))
+    expected_signals, expected_orders, expected_total = run_backtest(params)
+    assert signals == expected_signals
+    assert orders == expected_orders
+
+
+def test_live_fills_at_order_bar():
+    # The fills settle between two signals, so sizing and fill prices are the backtest's
+    params = {'short_window': 50, 'long_window': 200}
+    signals, orders, total = asyncio.run(run_live(params))
+    assert total == pytest.approx(run_backtest(params)[2])
+
+
+def test_live_padded_rows_have_zero_returns():
+    bars = LiveDataHandler(DequeEventBus(), ['A', 'B'], max_bars=10, lookback=5)
+    bars.append_bar(pd.Timestamp('2020-01-02'), {'A': {'adj_close': 10.0}})
+    bars.append_bar(pd.Timestamp('2020-01-03'), {'A': {'adj_close': 11.0}, 'B': {'adj_close': 20.0}})
+    bars.append_bar(pd.Timestamp('2020-01-06'), {'A': {'adj_close': 12.1}})
+    assert np.isnan(bars.get_latest_bars_values('B', 'returns', 3)[:2]).all() # B还没有上市
+    assert bars.get_latest_bar_value('B', 'adj_close') == 20.0
+    assert bars.get_latest_bar_value('B', 'returns') == 0.0
+    assert bars.get_latest_bar_value('A', 'returns') == pytest.approx(0.1)
@@ -0,0 +1,63 @@
+import contextlib
+import io
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from pytrade.backtest import Backtest
+from pytrade.datahandler import HistoricCSVDataHandler
+from pytrade.execution import SimulatedExecutionHandler
+from pytrade.performance import create_drawdowns, create_sharpe_ratio
+from pytrade.portfolio import Portfolio
+from pytrade.strategy import CrossSectionalStrategy
+
+
+class MomentumStrategy(CrossSectionalStrategy):
+    """
+    Holds 100 shares of the symbols above their price 5 bars ago; symbols not
+    listed yet (NaN prices) get no position.
+    """
+    target_kind = 'quantity'
+
+    def __init__(self, bars, account, events):
+        super(MomentumStrategy, self).__init__(bars, account, events, window=6)
+
+    def calculate_targets(self, prices):
+        if len(prices) < self.window:
+            return np.zeros(prices.shape[1])
+        return np.where(prices[-1] > prices[0], 100.0, 0.0)
+
+
+def write_symbol(csv_dir, symbol, dates, seed):
+    rng = np.random.default_rng(seed)
+    close = 50.0 * np.exp(np.cumsum(rng.normal(0.0, 0.02, len(dates))))
+    pd.DataFrame({
+        'Date': dates.strftime('%Y-%m-%d'), 'Open': close, 'High': close, 'Low': close,
+        'Close': close, 'Volumn': 1000, 'Adj Close': close,
+    }).to_csv(os.path.join(csv_dir, f'{symbol}.csv'), index=False)
+
+
+def test_streaming_stats_with_late_listed_symbol(tmp_path):
+    # LATE只在第150个bar之后才有数据, 之前的价格是NaN
+    dates = pd.bdate_range('2000-01-03', periods=300)
+    write_symbol(str(tmp_path), 'EARLY', dates, 0)
+    write_symbol(str(tmp_path), 'LATE', dates[150:], 1)
+    with contextlib.redirect_stdout(io.StringIO()):
+        backtest = Backtest(str(tmp_path), ['EARLY', 'LATE'], 100000.0, 0.0, None, None,
+                            HistoricCSVDataHandler, SimulatedExecutionHandler, Portfolio, MomentumStrategy)
+        backtest._run_backtest()
+    portfolio = backtest.portfolio
+    portfolio.create_equity_curve_dataframe()
+    curve = portfolio.equity_curve
+    assert np.isfinite(curve['total']).all()
+    assert backtest.fills > 0
+
+    stats = portfolio.get_current_stats()
+    assert np.isfinite(stats['sharpe_ratio'])
+    assert stats['sharpe_ratio'] == pytest.approx(create_sharpe_ratio(curve['returns']))
+    drawdown, max_dd, duration = create_drawdowns(curve['equity_curve'])
+    assert stats['max_drawdown'] == pytest.approx(max_dd)